@@ -81,15 +81,11 @@ def main():
 
 
     if config.get('labs_db'):
-        entries = coord_dao.add_entries_from_cat(rnd, 'Images_from_Wiki_Loves_Monuments_2015_in_Pakistan')
+        coord_dao.add_entries_from_cat(rnd, 'Images_from_Wiki_Loves_Monuments_2015_in_Pakistan',
+                                       autodisqualify=True)
     else:
-        entries = coord_dao.add_entries_from_csv_gist(rnd, GIST_URL)
-
-    coord_dao.add_round_entries(rnd, entries)
-
-    coord_dao.autodisqualify_by_date(rnd)
-    coord_dao.autodisqualify_by_resolution(rnd)
-    coord_dao.autodisqualify_by_uploader(rnd)
+        coord_dao.add_entries_from_csv_gist(rnd, GIST_URL,
+                                            autodisqualify=True)
 
     #coord_dao.disqualify_entry(entry)
 
@@ -115,8 +111,7 @@ def main():
                                  deadline_date=datetime.datetime(2015, 10, 15),
                                  jurors=juror_usernames,
                                  campaign=campaign)
-    entries = coord_dao.add_entries_from_csv_gist(rnd, GIST_URL)
-    coord_dao.add_round_entries(rnd, entries)
+    coord_dao.add_entries_from_csv_gist(rnd, GIST_URL)
     coord_dao.activate_round(rnd)
 
     rate_round_tasks(rdb_session, rnd, limit_per=50)
@@ -151,10 +146,7 @@ def main():
                                   deadline_date=datetime.datetime(2015, 11, 1))
     final_rnds = [r for r in campaign.rounds if r.status == 'finalized']
     last_successful_rnd = final_rnds[-1]  # TODO: these are ordered by date?
-    advancing_group = coord_dao.get_rating_advancing_group(last_successful_rnd)
-
-    source = 'round(#%s)' % last_successful_rnd.id
-    coord_dao.add_round_entries(rnd2, advancing_group, source)
+    coord_dao.add_round_entries_from_round(rnd2, last_successful_rnd)
     coord_dao.activate_round(rnd2)
 
     rate_round_tasks(rdb_session, rnd2, limit_per=20)
@@ -4,7 +4,13 @@ from clastic.errors import Forbidden
 from boltons.strutils import slugify
 from boltons.timeutils import isoparse
 
-from utils import format_date, get_threshold_map, InvalidAction, DoesNotExist
+from utils import format_date, parse_date, InvalidAction, DoesNotExist
+from exporters import make_csv_response
+from tally import ThresholdExplorer
+from loaders import (get_entries_from_gist_csv,
+                     get_names_from_gist_csv,
+                     load_category,
+                     load_categories)
 
 from rdb import (CoordinatorDAO,
                  MaintainerDAO,
@@ -17,16 +23,37 @@ def get_admin_routes():
            GET('/admin/campaign/<campaign_id:int>', get_campaign),
            POST('/admin/campaign/<campaign_id:int>/edit', edit_campaign),
            POST('/admin/campaign/<campaign_id:int>/new/round', create_round),
+           POST('/admin/campaign/<campaign_id:int>/finalize',
+                finalize_campaign),
            POST('/admin/round/<round_id:int>/import', import_entries),
+           POST('/admin/round/<round_id:int>/preview_import',
+                preview_import),
+           GET('/admin/import/<job_id:int>', get_import_job),
+           POST('/admin/import/<job_id:int>/resume', resume_import),
+           POST('/admin/import/<job_id:int>/cancel', cancel_import),
            POST('/admin/round/<round_id:int>/activate', activate_round),
            POST('/admin/round/<round_id:int>/pause', pause_round),
+           POST('/admin/round/<round_id:int>/autodisqualify',
+                autodisqualify),
+           POST('/admin/round/<round_id:int>/disqualify',
+                disqualify_entries),
+           POST('/admin/round/<round_id:int>/requalify',
+                requalify_entries),
            GET('/admin/round/<round_id:int>', get_round),
            POST('/admin/round/<round_id:int>/edit', edit_round),
            POST('/admin/round/<round_id:int>/edit_jurors', modify_jurors),
            GET('/admin/round/<round_id:int>/preview_results',
                get_round_results_preview),
+           GET('/admin/round/<round_id:int>/juror_stats',
+               get_round_juror_stats),
            POST('/admin/round/<round_id:int>/finalize',
                 finalize_round),
+           GET('/admin/round/<round_id:int>/download/entries',
+               download_round_entries),
+           GET('/admin/round/<round_id:int>/download/votes',
+               download_round_votes),
+           GET('/admin/round/<round_id:int>/download/results',
+               download_round_results),
            POST('/admin/add_organizer', add_organizer),
            POST('/admin/add_coordinator/campaign/<campaign_id:int>',
                 add_coordinator),
@@ -104,6 +131,18 @@ def import_entries(rdb_session, user, round_id, request_dict):
             type: string
         import_url:
             type: string
+        category:
+            type: string
+        categories:
+            type: array
+            items:
+                type: string
+        prev_round_id:
+            type: int64
+        threshold:
+            type: float
+        autodisqualify:
+            type: boolean
 
     Response model name: EntryImportDetails
     Response model:
@@ -120,24 +159,160 @@ def import_entries(rdb_session, user, round_id, request_dict):
     rnd = coord_dao.get_round(round_id)
 
     import_method = request_dict.get('import_method')
-
-    if import_method == 'gistcsv':
+    autodisqualify = request_dict.get('autodisqualify', False)
+
+    if import_method == 'round':
+        prev_rnd = coord_dao.get_round(request_dict.get('prev_round_id'))
+        if prev_rnd is None:
+            raise DoesNotExist('could not find round to import from')
+        threshold = request_dict.get('threshold')
+        new_count = coord_dao.add_round_entries_from_round(rnd, prev_rnd,
+                                                           threshold)
+        data = {'round_id': rnd.id,
+                'new_entry_count': 0,
+                'new_round_entry_count': new_count,
+                'total_entries': coord_dao.get_round_entry_count(rnd)}
+        return {'data': data}
+    elif import_method == 'gistcsv':
         gist_url = request_dict.get('gist_url')
-        entries = coord_dao.add_entries_from_csv_gist(rnd, gist_url)
-        source = 'gistcsv(%s)' % gist_url
+        import_stats = coord_dao.add_entries_from_csv_gist(
+            rnd, gist_url, autodisqualify=autodisqualify)
+    elif import_method == 'gistcsv_brief':
+        gist_url = request_dict.get('gist_url')
+        import_stats = coord_dao.add_entries_from_brief_csv_gist(
+            rnd, gist_url, autodisqualify=autodisqualify)
     elif import_method == 'category':
-        cat_name = request_dict.get('category')
-        entries = coord_dao.add_entries_from_cat(rnd, cat_name)
-        source = 'category(%s)' % cat_name
+        cat_names = request_dict.get('categories')
+        if cat_names:
+            import_stats = coord_dao.add_entries_from_cats(
+                rnd, cat_names, autodisqualify=autodisqualify)
+        else:
+            cat_name = request_dict.get('category')
+            import_stats = coord_dao.add_entries_from_cat(
+                rnd, cat_name, autodisqualify=autodisqualify)
     else:
         raise NotImplementedError()
 
-    new_entries = coord_dao.add_round_entries(rnd, entries, source=source)
+    return {'data': _get_import_details(coord_dao, rnd, import_stats)}
+
+
+def _get_import_details(coord_dao, rnd, import_stats):
+    ret = {'round_id': rnd.id,
+           'import_job_id': import_stats['import_job_id'],
+           'status': import_stats['status'],
+           'new_entry_count': import_stats['new_entry_count'],
+           'new_round_entry_count': import_stats['new_round_entry_count'],
+           'disqualified_count': import_stats['disqualified_count'],
+           'total_entries': coord_dao.get_round_entry_count(rnd)}
+    if 'missing_names' in import_stats:
+        ret['missing_names'] = import_stats['missing_names']
+    return ret
+
+
+def get_import_job(rdb_session, user, job_id):
+    """
+    Summary: Get the progress of an entry import
+
+    Request model:
+        job_id:
+            type: int64
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    job = coord_dao.get_import_job(job_id)
+    return {'data': job.to_info_dict()}
+
+
+def resume_import(rdb_session, user, job_id):
+    """
+    Summary: Resume a failed, cancelled or stalled entry import from its
+    last checkpoint
+
+    Request model:
+        job_id:
+            type: int64
+    """
+    if not user.is_maintainer:  # TODO: check if user is an organizer or coord
+        raise Forbidden('not allowed to import entries')
+
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    job = coord_dao.get_import_job(job_id)
+    import_stats = coord_dao.resume_import(job)
+    return {'data': _get_import_details(coord_dao, job.round, import_stats)}
+
+
+def cancel_import(rdb_session, user, job_id):
+    """
+    Summary: Stop a running entry import after its current chunk
+
+    Request model:
+        job_id:
+            type: int64
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    job = coord_dao.get_import_job(job_id)
+    coord_dao.cancel_import(job)
+    return {'data': job.to_info_dict()}
+
+
+def preview_import(rdb_session, user, round_id, request_dict):
+    """
+    Summary: Count the entries an import would add to a round, without
+    importing anything.
 
-    data = {'round_id': rnd.id,
-            'new_entry_count': len(entries),
-            'new_round_entry_count': len(new_entries),
-            'total_entries': len(rnd.entries)}
+    Request model:
+        round_id:
+            type: int64
+        import_method:
+            type: string
+        gist_url:
+            type: string
+        category:
+            type: string
+        categories:
+            type: array
+            items:
+                type: string
+
+    Response model name: EntryImportPreview
+    Response model:
+        total_count:
+            type: int64
+        known_count:
+            type: int64
+        new_count:
+            type: int64
+        in_round_count:
+            type: int64
+        new_round_entry_count:
+            type: int64
+        disqualified_count:
+            type: int64
+    """
+    if not user.is_maintainer:  # TODO: check if user is an organizer or coord
+        raise Forbidden('not allowed to import entries')
+
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    rnd = coord_dao.get_round(round_id)
+
+    import_method = request_dict.get('import_method')
+
+    if import_method == 'gistcsv':
+        raw_entries = get_entries_from_gist_csv(request_dict.get('gist_url'))
+    elif import_method == 'gistcsv_brief':
+        names = get_names_from_gist_csv(request_dict.get('gist_url'))
+        raw_entries = coord_dao.resolve_entry_names(names)
+    elif import_method == 'category':
+        cat_names = request_dict.get('categories')
+        if cat_names:
+            raw_entries = load_categories(cat_names)
+        else:
+            raw_entries = load_category(request_dict.get('category'))
+    else:
+        raise InvalidAction('import previews are only available for gistcsv,'
+                            ' gistcsv_brief and category imports')
+
+    data = coord_dao.preview_import(rnd, raw_entries)
+    data['round_id'] = rnd.id
     return {'data': data}
 
 
@@ -176,6 +351,100 @@ def pause_round(rdb_session, user, round_id, request_dict):
     return {'data': rnd}
 
 
+def autodisqualify(rdb_session, user, round_id, request_dict):
+    """
+    Summary: Disqualify a round's entries by upload date, resolution
+    and/or uploader, cancelling their open tasks if the round has
+    started, or with dry_run, count the entries that would be
+    disqualified.
+
+    Request model:
+        round_id:
+            type: int64
+        rules:
+            type: array
+            items:
+                type: string
+        dry_run:
+            type: boolean
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    rnd = coord_dao.get_round(round_id)
+    if not rnd:
+        raise DoesNotExist()
+
+    rule_methods = {'date': coord_dao.autodisqualify_by_date,
+                    'resolution': coord_dao.autodisqualify_by_resolution,
+                    'uploader': coord_dao.autodisqualify_by_uploader}
+    rules = request_dict.get('rules') or ['date', 'resolution', 'uploader']
+    dry_run = request_dict.get('dry_run', False)
+
+    dq_counts = {}
+    for rule in rules:
+        if rule not in rule_methods:
+            raise InvalidAction('unknown disqualification rule: %r' % rule)
+        dq_counts[rule] = rule_methods[rule](rnd, dry_run=dry_run)
+
+    return {'data': {'round_id': rnd.id,
+                     'dry_run': dry_run,
+                     'dq_counts': dq_counts}}
+
+
+def disqualify_entries(rdb_session, user, round_id, request_dict):
+    """
+    Summary: Disqualify a list of round entries, cancelling their open
+    tasks if the round has started.
+
+    Request model:
+        round_id:
+            type: int64
+        round_entry_ids:
+            type: array
+            items:
+                type: int64
+        reason:
+            type: string
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    rnd = coord_dao.get_round(round_id)
+    if not rnd:
+        raise DoesNotExist()
+
+    round_entry_ids = request_dict.get('round_entry_ids') or []
+    reason = request_dict.get('reason')
+    dq_count = coord_dao.disqualify_round_entries(rnd, round_entry_ids,
+                                                  reason=reason)
+
+    return {'data': {'round_id': rnd.id,
+                     'disqualified_count': dq_count}}
+
+
+def requalify_entries(rdb_session, user, round_id, request_dict):
+    """
+    Summary: Reverse the disqualification of a list of round entries,
+    before the round has opened.
+
+    Request model:
+        round_id:
+            type: int64
+        round_entry_ids:
+            type: array
+            items:
+                type: int64
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    rnd = coord_dao.get_round(round_id)
+    if not rnd:
+        raise DoesNotExist()
+
+    round_entry_ids = request_dict.get('round_entry_ids') or []
+    requalified_count = coord_dao.requalify_round_entries(rnd,
+                                                          round_entry_ids)
+
+    return {'data': {'round_id': rnd.id,
+                     'requalified_count': requalified_count}}
+
+
 def edit_campaign(rdb_session, user, campaign_id, request_dict):
     """
     Summary: Change the settings for a round identified by a round ID.
@@ -198,6 +467,27 @@ def edit_campaign(rdb_session, user, campaign_id, request_dict):
     return {'data': campaign_dict}
 
 
+def finalize_campaign(rdb_session, user, campaign_id):
+    """
+    Summary: Finalize a campaign, materializing its public results
+
+    Request model:
+        campaign_id:
+            type: int64
+
+    Errors:
+       403: User does not have permission to finalize the campaign
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    campaign = coord_dao.get_campaign(campaign_id)
+    if campaign is None:
+        raise Forbidden('not a coordinator on this campaign')
+
+    results = coord_dao.finalize_campaign(campaign)
+
+    return {'data': results.summary}
+
+
 def create_round(rdb_session, user, campaign_id, request_dict):
     """
     Summary: Post a new round
@@ -313,35 +603,159 @@ def modify_jurors(rdb_session, user, round_id, request_dict):
     return {'data': rnd_dict}
 
 
-def get_round_results_preview(rdb_session, user, round_id):
+def get_round_results_preview(rdb_session, user, round_id, request_dict):
+    """
+    Summary: Preview the results of a rating round
+
+    Thresholds map each candidate threshold to the number of entries at
+    or above it, and uploader_thresholds to the number of distinct
+    uploaders. Pass a threshold to get both counts for that exact value.
+
+    Request model:
+        round_id:
+            type: int64
+        threshold:
+            type: float
+    """
     coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
     rnd = coord_dao.get_round(round_id)
 
     round_counts = coord_dao.get_round_task_counts(rnd)
     is_closeable = round_counts['total_open_tasks'] == 0
 
-    rating_map = coord_dao.get_round_average_rating_map(rnd)
-    thresh_map = get_threshold_map(rating_map)
+    summary = coord_dao.get_round_results_summary(rnd)
+
+    data = {'round': rnd.to_info_dict(),
+            'counts': round_counts,
+            'ratings': dict(summary['ratings']),
+            'thresholds': dict(summary['thresholds']),
+            'uploader_thresholds': dict(summary['uploader_thresholds']),
+            'histogram': dict(summary['histogram']),
+            'vote_count': summary['vote_count'],
+            'is_closeable': is_closeable}
+
+    threshold = (request_dict or {}).get('threshold')
+    if threshold is not None:
+        explorer = ThresholdExplorer(summary['threshold_curve'])
+        entry_count, uploader_count = explorer.get_counts(float(threshold))
+        data['threshold_counts'] = {'threshold': float(threshold),
+                                    'entry_count': entry_count,
+                                    'uploader_count': uploader_count}
+
+    return {'data': data}
 
-    return {'data': {'round': rnd.to_info_dict(),
-                     'counts': round_counts,
-                     'ratings': rating_map,
-                     'thresholds': thresh_map,
-                     'is_closeable': is_closeable}}
+
+def get_round_juror_stats(rdb_session, user, round_id):
+    """
+    Summary: Get rating statistics for each juror in a round, and the
+    round's overall inter-rater agreement (Krippendorff's alpha)
+
+    Request model:
+        round_id:
+            type: int64
+    """
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    rnd = coord_dao.get_round(round_id)
+    if rnd is None:
+        raise Forbidden('not a coordinator for this round')
+    if rnd.vote_method not in ('rating', 'yesno'):
+        raise InvalidAction('juror stats are only available for rating and'
+                            ' yes/no rounds')
+
+    stats = dict(coord_dao.get_round_juror_stats(rnd))
+    username_map = dict([(u.id, u.username) for u in rnd.jurors])
+    stats['jurors'] = [dict(js, username=username_map.get(js['user_id']))
+                       for js in stats['jurors']]
+
+    return {'data': stats}
 
 
 def finalize_round(rdb_session, user, round_id, request_dict):
     coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
     rnd = coord_dao.get_round(round_id)
 
-    if rnd.voting_method in ('rating', 'yesno'):
+    if rnd.vote_method in ('rating', 'yesno'):
         threshold = request_dict['threshold']
         coord_dao.finalize_rating_round(rnd, threshold=threshold)
+    elif rnd.vote_method == 'ranking':
+        method = request_dict.get('method', 'schulze')
+        ranking = coord_dao.finalize_ranking_round(rnd, method=method)
+        return {'data': {'ranking': ranking}}
     else:
         raise NotImplementedError()
     return {}
 
 
+ROUND_ENTRY_CSV_HEADER = ['round_entry_id', 'filename', 'mime_major',
+                          'mime_minor', 'width', 'height', 'resolution',
+                          'upload_user_text', 'upload_date', 'dq_reason']
+ROUND_VOTE_CSV_HEADER = ['id', 'filename', 'juror', 'value', 'date']
+RATING_RESULT_CSV_HEADER = ['round_entry_id', 'filename', 'upload_user_text',
+                            'average', 'vote_count']
+RANKING_RESULT_CSV_HEADER = ['round_entry_id', 'filename', 'score']
+
+
+def _get_coord_round(rdb_session, user, round_id):
+    coord_dao = CoordinatorDAO(rdb_session=rdb_session, user=user)
+    rnd = coord_dao.get_round(round_id)
+    if rnd is None:
+        raise Forbidden('not a coordinator for this round')
+    return coord_dao, rnd
+
+
+def download_round_entries(rdb_session, user, round_id, request):
+    """
+    Summary: Download a CSV of a round's entries (its inputs), including
+    disqualified entries and the reasons they were disqualified.
+
+    Request model:
+        round_id:
+            type: int64
+    """
+    coord_dao, rnd = _get_coord_round(rdb_session, user, round_id)
+    row_batches = coord_dao.get_round_entry_rows(rnd)
+    filename = 'round_%s_entries.csv' % round_id
+    return make_csv_response(request, filename, ROUND_ENTRY_CSV_HEADER,
+                             row_batches, on_close=rdb_session.close)
+
+
+def download_round_votes(rdb_session, user, round_id, request):
+    """
+    Summary: Download a CSV of a round's individual ratings or rankings,
+    with the juror and date of each.
+
+    Request model:
+        round_id:
+            type: int64
+    """
+    coord_dao, rnd = _get_coord_round(rdb_session, user, round_id)
+    row_batches = coord_dao.get_round_vote_rows(rnd)
+    filename = 'round_%s_votes.csv' % round_id
+    return make_csv_response(request, filename, ROUND_VOTE_CSV_HEADER,
+                             row_batches, on_close=rdb_session.close)
+
+
+def download_round_results(rdb_session, user, round_id, request):
+    """
+    Summary: Download a CSV of a round's results: each entry's average
+    rating and vote count, or for a ranking round, each entry's score in
+    rank order. Disqualified entries are left out.
+
+    Request model:
+        round_id:
+            type: int64
+    """
+    coord_dao, rnd = _get_coord_round(rdb_session, user, round_id)
+    if rnd.vote_method == 'ranking':
+        header = RANKING_RESULT_CSV_HEADER
+    else:
+        header = RATING_RESULT_CSV_HEADER
+    row_batches = coord_dao.get_round_result_rows(rnd)
+    filename = 'round_%s_results.csv' % round_id
+    return make_csv_response(request, filename, header,
+                             row_batches, on_close=rdb_session.close)
+
+
 def get_index(rdb_session, user):
     """
     Summary: Get admin-level details for all campaigns.
@@ -467,17 +881,67 @@ def get_round(rdb_session, user, round_id):
 
 
 def get_audit_logs(rdb_session, user, request_dict):
+    """
+    Summary: Get audit log entries, newest first, optionally filtered.
+    Page through them by passing the next_before_id of one response
+    as the before_id of the next request.
+
+    Request model:
+        limit:
+            type: int64
+        offset:
+            type: int64
+        before_id:
+            type: int64
+        campaign_id:
+            type: int64
+        round_id:
+            type: int64
+        user_id:
+            type: int64
+        action:
+            type: string
+        start_date:
+            type: date-time
+        end_date:
+            type: date-time
+
+    Response model:
+        data:
+            type: array
+        next_before_id:
+            type: int64
+    """
     if not user.is_maintainer:
         raise Forbidden('not allowed to view the audit log')
 
-    limit = request_dict.get('limit', 10)
-    offset = request_dict.get('offset', 0)
+    request_dict = request_dict or {}
+    try:
+        limit = int(request_dict.get('limit', 10))
+        offset = int(request_dict.get('offset', 0))
+        id_filters = {}
+        for key in ('before_id', 'campaign_id', 'round_id', 'user_id'):
+            if request_dict.get(key) is not None:
+                id_filters[key] = int(request_dict[key])
+        start_date = parse_date(request_dict.get('start_date'))
+        end_date = parse_date(request_dict.get('end_date'))
+    except ValueError as ve:
+        raise InvalidAction('invalid audit log filter: %s' % ve)
 
     main_dao = MaintainerDAO(rdb_session, user)
-    audit_logs = main_dao.get_audit_log(limit=limit, offset=offset)
+    audit_logs = main_dao.get_audit_log(limit=limit,
+                                        offset=offset,
+                                        action=request_dict.get('action'),
+                                        start_date=start_date,
+                                        end_date=end_date,
+                                        **id_filters)
     data = [l.to_info_dict() for l in audit_logs]
 
-    return {'data': data}
+    next_before_id = None
+    if audit_logs and len(audit_logs) == limit:
+        next_before_id = audit_logs[-1].id
+
+    return {'data': data, 'next_before_id': next_before_id}
 
 
 def add_organizer(rdb_session, user, request_dict):
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Juror agreement and reliability statistics for rating rounds.
+
+A round's ratings are loaded once into a sparse juror x entry matrix,
+kept in coordinate form as three parallel typed arrays. Per-juror and
+per-entry sums are accumulated while loading, so the statistics below
+need only one more pass over the arrays.
+
+For each juror:
+
+* mean, variance and skew of their ratings
+* consensus_deviation: the mean absolute difference between their
+  rating and the average of the other jurors' ratings of the same entry
+* agreement: 1 - consensus_deviation (ratings are all between 0 and 1)
+
+For the round as a whole, Krippendorff's alpha, using the interval
+metric. 1.0 is perfect agreement, 0.0 is no better than chance.
+"""
+
+from array import array
+from math import sqrt
+
+
+class RatingMatrix(object):
+    """*rating_triples* is an iterable of (user_id, round_entry_id,
+    value) triples, in any order.
+    """
+    def __init__(self, rating_triples):
+        self.juror_ids = []
+        self.round_entry_ids = []
+        self.juror_idxs = array('l')
+        self.entry_idxs = array('l')
+        self.values = array('d')
+
+        juror_idx_map, entry_idx_map = {}, {}
+        self._juror_sums = [array('d'), array('d'), array('d'), array('d')]
+        self._entry_sums = [array('d'), array('d'), array('d')]
+
+        for user_id, round_entry_id, value in rating_triples:
+            j_idx = juror_idx_map.get(user_id)
+            if j_idx is None:
+                j_idx = len(self.juror_ids)
+                juror_idx_map[user_id] = j_idx
+                self.juror_ids.append(user_id)
+                for sums in self._juror_sums:
+                    sums.append(0.0)
+            e_idx = entry_idx_map.get(round_entry_id)
+            if e_idx is None:
+                e_idx = len(self.round_entry_ids)
+                entry_idx_map[round_entry_id] = e_idx
+                self.round_entry_ids.append(round_entry_id)
+                for sums in self._entry_sums:
+                    sums.append(0.0)
+
+            self.juror_idxs.append(j_idx)
+            self.entry_idxs.append(e_idx)
+            self.values.append(value)
+
+            j_counts, j_sums, j_sq_sums, j_cube_sums = self._juror_sums
+            j_counts[j_idx] += 1
+            j_sums[j_idx] += value
+            j_sq_sums[j_idx] += value ** 2
+            j_cube_sums[j_idx] += value ** 3
+
+            e_counts, e_sums, e_sq_sums = self._entry_sums
+            e_counts[e_idx] += 1
+            e_sums[e_idx] += value
+            e_sq_sums[e_idx] += value ** 2
+
+    def get_juror_stats(self):
+        j_counts, j_sums, j_sq_sums, j_cube_sums = self._juror_sums
+        e_counts, e_sums, _ = self._entry_sums
+
+        deviation_sums = array('d', [0.0]) * len(self.juror_ids)
+        deviation_counts = array('l', [0]) * len(self.juror_ids)
+        for j_idx, e_idx, value in zip(self.juror_idxs,
+                                       self.entry_idxs,
+                                       self.values):
+            others_count = e_counts[e_idx] - 1
+            if not others_count:
+                continue
+            others_mean = (e_sums[e_idx] - value) / others_count
+            deviation_sums[j_idx] += abs(value - others_mean)
+            deviation_counts[j_idx] += 1
+
+        ret = []
+        for j_idx, user_id in enumerate(self.juror_ids):
+            count = j_counts[j_idx]
+            mean = j_sums[j_idx] / count
+            variance = max(j_sq_sums[j_idx] / count - mean ** 2, 0.0)
+            skew = None
+            if variance:
+                third_moment = (j_cube_sums[j_idx] / count
+                                - 3 * mean * j_sq_sums[j_idx] / count
+                                + 2 * mean ** 3)
+                skew = third_moment / sqrt(variance) ** 3
+            deviation, agreement = None, None
+            if deviation_counts[j_idx]:
+                deviation = deviation_sums[j_idx] / deviation_counts[j_idx]
+                agreement = 1 - deviation
+            ret.append({'user_id': user_id,
+                        'rating_count': int(count),
+                        'mean': mean,
+                        'variance': variance,
+                        'skew': skew,
+                        'consensus_deviation': deviation,
+                        'agreement': agreement})
+        return ret
+
+    def get_alpha(self):
+        """Krippendorff's alpha (interval metric), from the per-entry
+        sums. For an entry rated m times with sum S and sum of squares Q,
+        the squared differences over all ordered pairs of its ratings add
+        up to 2 * (m * Q - S ** 2). Entries rated only once are not
+        pairable and are left out. Returns None when there is no
+        variation at all to measure agreement against.
+        """
+        total_count = total_sum = total_sq_sum = 0.0
+        observed = 0.0
+        for count, e_sum, e_sq_sum in zip(*self._entry_sums):
+            if count < 2:
+                continue
+            total_count += count
+            total_sum += e_sum
+            total_sq_sum += e_sq_sum
+            observed += 2 * (count * e_sq_sum - e_sum ** 2) / (count - 1)
+        if total_count < 2:
+            return None
+        observed /= total_count
+        expected = (2 * (total_count * total_sq_sum - total_sum ** 2)
+                    / (total_count * (total_count - 1)))
+        if not expected:
+            return None
+        return 1 - observed / expected
+
+    def to_dict(self):
+        return {'jurors': self.get_juror_stats(),
+                'alpha': self.get_alpha(),
+                'juror_count': len(self.juror_ids),
+                'entry_count': len(self.round_entry_ids),
+                'vote_count': len(self.values)}
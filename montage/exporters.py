@@ -0,0 +1,56 @@
+import zlib
+from io import BytesIO
+
+from unicodecsv import writer as csv_writer
+from werkzeug.wrappers import Response
+
+from utils import format_date
+
+GZIP_LEVEL = 6
+
+
+def iter_csv_chunks(header, row_batches):
+    """Yields CSV-encoded bytes, one chunk per batch of rows, so that
+    nothing more than a single batch is ever held in memory.
+    """
+    buff = BytesIO()
+    writer = csv_writer(buff, encoding='utf8')
+    writer.writerow(header)
+    for rows in row_batches:
+        writer.writerows([[format_date(v) for v in row] for row in rows])
+        yield buff.getvalue()
+        buff.seek(0)
+        buff.truncate()
+    if buff.tell():
+        yield buff.getvalue()
+
+
+def iter_gzip_chunks(chunks):
+    # wbits offset of 16 gets us gzip framing, rather than raw zlib
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def make_csv_response(request, filename, header, row_batches,
+                      on_close=None):
+    """Creates a streaming (chunked) CSV download response, gzipped if
+    the client accepts it. *on_close* is called once the response has
+    been sent, e.g., to close the database session the rows come from.
+    """
+    chunks = iter_csv_chunks(header, row_batches)
+    headers = {'Content-Disposition': 'attachment; filename=%s' % filename}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = iter_gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    headers['Vary'] = 'Accept-Encoding'
+
+    resp = Response(chunks, mimetype='text/csv', headers=headers,
+                    direct_passthrough=True)
+    if on_close is not None:
+        resp.call_on_close(on_close)
+    return resp
@@ -0,0 +1,94 @@
+"""Fetching of remote import sources, like gist CSVs, through a local
+cache.
+
+Responses are cached on disk under a key derived from the URL, along
+with their ETag and Last-Modified validators. Later fetches of the same
+URL make a conditional request, and on a 304 Not Modified are read
+straight from disk. Fresh responses are streamed: lines are handed to
+the caller (i.e., the CSV parser) as they arrive, and written to the
+cache at the same time. The cache file only replaces the previous
+version once the whole body has been read.
+"""
+
+import os
+import json
+import hashlib
+import urllib2
+from tempfile import NamedTemporaryFile
+
+from boltons.fileutils import atomic_save, mkdir_p
+
+
+CACHE_PATH = os.path.expanduser('~/.montage/url_cache')
+FETCH_TIMEOUT = 60
+
+
+def get_cache_key(url):
+    if isinstance(url, unicode):
+        url = url.encode('utf8')
+    return hashlib.sha1(url).hexdigest()
+
+
+def open_cached_url(url, cache_path=CACHE_PATH):
+    """Returns an iterable of the lines of the resource at *url*:
+    either the cached copy, if the server says it is still current, or
+    a generator that streams the response while caching it.
+    """
+    data_path = os.path.join(cache_path, get_cache_key(url))
+    meta_path = data_path + '.json'
+
+    meta = None
+    if os.path.exists(data_path) and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+
+    req = urllib2.Request(url)
+    if meta and meta.get('etag'):
+        req.add_header('If-None-Match', meta['etag'])
+    if meta and meta.get('last_modified'):
+        req.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        resp = urllib2.urlopen(req, timeout=FETCH_TIMEOUT)
+    except urllib2.HTTPError as he:
+        if he.code == 304 and meta:
+            return _iter_cached_lines(data_path)
+        raise
+
+    headers = resp.info()
+    meta = {'url': url,
+            'etag': headers.getheader('ETag'),
+            'last_modified': headers.getheader('Last-Modified')}
+    return _iter_caching_lines(resp, data_path, meta)
+
+
+def _iter_cached_lines(data_path):
+    with open(data_path, 'rb') as data_file:
+        for line in data_file:
+            yield line
+
+
+def _iter_caching_lines(resp, data_path, meta):
+    cache_path = os.path.dirname(data_path)
+    mkdir_p(cache_path)
+    tmp_file = NamedTemporaryFile(dir=cache_path, delete=False)
+    complete = False
+    try:
+        for line in resp:
+            tmp_file.write(line)
+            yield line
+        complete = True
+    finally:
+        resp.close()
+        tmp_file.close()
+        if not complete:
+            # the reader stopped early (e.g., a bad CSV header), so
+            # don't cache a partial body
+            os.remove(tmp_file.name)
+
+    meta_path = data_path + '.json'
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    os.rename(tmp_file.name, data_path)
+    with atomic_save(meta_path) as meta_file:
+        json.dump(meta, meta_file)
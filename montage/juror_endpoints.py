@@ -379,7 +379,7 @@ def submit_ratings(rdb_session, user, request_dict):
         sorted_rs = sorted(r_dicts, key=lambda r: r['value'])
         sorted_rank_task_pairs = [(int(r['value']), task_map[r['task_id']])
                                   for r in sorted_rs]
-        rank_items = [tuple(t) for r, t in
+        rank_items = [tuple([t for _, t in group]) for r, group in
                       groupby(sorted_rank_task_pairs, key=lambda rt: rt[0])]
         #  rank_map = dict(rank_items)  # might be clearer
 
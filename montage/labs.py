@@ -1,4 +1,9 @@
 import os
+import Queue
+import threading
+from contextlib import contextmanager
+
+from boltons.iterutils import chunked_iter
 
 try:
     import oursql
@@ -7,25 +12,146 @@ except ImportError:
 
 
 DB_CONFIG = os.path.expanduser('~/replica.my.cnf')
+FETCH_BATCH_SIZE = 1000
+POOL_SIZE = 4
+POOL_TIMEOUT = 30
+
+# just the image columns that make it into an Entry. img_metadata, for
+# one, can be several KB of serialized EXIF per file.
+IMAGE_COLS = ['img_name',
+              'img_major_mime',
+              'img_minor_mime',
+              'img_width',
+              'img_height',
+              'img_user',
+              'img_user_text',
+              'img_timestamp']
 
 
 class MissingMySQLClient(RuntimeError):
     pass
 
 
-def get_files(category_name):
+class PoolExhausted(RuntimeError):
+    pass
+
+
+# the errors that mean the replica can't be reached right now, as
+# opposed to a problem with the query
+REPLICA_ERRORS = (MissingMySQLClient, PoolExhausted)
+if oursql is not None:
+    REPLICA_ERRORS += (oursql.Error,)
+
+
+class ConnectionPool(object):
+    """A bounded pool of DB-API connections, created on demand by
+    *connect* and checked with a trivial query before being reused.
+
+    The queue starts out holding *max_size* empty slots (None). Taking
+    a slot either reuses the connection in it or makes a new one, so
+    there are never more than *max_size* connections open, and
+    acquiring blocks for up to *timeout* seconds when all are in use.
+    """
+    def __init__(self, connect, max_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        # LIFO, so that the most recently used connections stay warm
+        self._slots = Queue.LifoQueue(max_size)
+        for _ in range(max_size):
+            self._slots.put(None)
+
+    def acquire(self):
+        try:
+            conn = self._slots.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise PoolExhausted('no connection available after %s seconds'
+                                % self.timeout)
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self.connect()
+        except Exception:
+            self._slots.put(None)
+            raise
+        return conn
+
+    def release(self, conn, discard=False):
+        if discard:
+            self._close(conn)
+            conn = None
+        self._slots.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Yields a pooled connection. If the block does not complete
+        (an exception, or a generator closed early, possibly leaving
+        unread rows) the connection is closed rather than reused.
+        """
+        conn = self.acquire()
+        complete = False
+        try:
+            yield conn
+            complete = True
+        finally:
+            self.release(conn, discard=not complete)
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def connect_replica():
     if oursql is None:
         raise MissingMySQLClient('could not import oursql, check your'
                                  ' environment and restart the service')
     db_title = 'commonswiki_p'
     db_host = 'commonswiki.labsdb'
-    connection = oursql.connect(db=db_title,
-                                host=db_host,
-                                read_default_file=DB_CONFIG,
-                                charset=None)
-    cursor = connection.cursor(oursql.DictCursor)
+    return oursql.connect(db=db_title,
+                          host=db_host,
+                          read_default_file=DB_CONFIG,
+                          charset=None)
+
+
+_replica_pool = None
+_replica_pool_lock = threading.Lock()
+
+
+def get_replica_pool():
+    "The process-wide pool of Commons replica connections"
+    global _replica_pool
+    with _replica_pool_lock:
+        if _replica_pool is None:
+            _replica_pool = ConnectionPool(connect_replica)
+    return _replica_pool
+
+
+def get_files(category_name, after_name=None, since=None):
+    """Generates a dict of IMAGE_COLS, plus cl_timestamp (when the file
+    was added to the category), for each file in a category, in name
+    order. Starts after *after_name* if it is passed (e.g., to resume an
+    import), and only includes files added at or after *since*, if it is
+    passed (e.g., to update the category mirror). Rows are streamed off
+    the replica FETCH_BATCH_SIZE at a time, rather than fetched all at
+    once.
+    """
+    cols = IMAGE_COLS + ['cl_timestamp']
     query = '''
-    SELECT *
+    SELECT %s
     FROM image
     JOIN page
     ON page_namespace = 6
@@ -33,13 +159,53 @@ def get_files(category_name):
     JOIN categorylinks
     ON cl_from = page_id
     AND cl_type = 'file'
-    AND cl_to = ?;
+    AND cl_to = ?
+    %s
+    ORDER BY img_name;
     '''
     params = (category_name.replace(' ', '_'),)
-    cursor.execute(query, params)
-    return cursor.fetchall()
+    conditions = []
+    if since:
+        conditions.append('cl_timestamp >= ?')
+        params += (since,)
+    if after_name:
+        conditions.append('img_name > ?')
+        params += (after_name,)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    query = query % (', '.join(cols), where)
+    with get_replica_pool().connection() as connection:
+        # oursql cursors are unbuffered, rows are read from the server
+        # as they are fetched
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(cols, row))
+        cursor.close()
+
+
+def get_files_by_name(file_names):
+    """Generates a dict of IMAGE_COLS for each of *file_names* (in
+    normalized, underscored form) that exists on Commons. Names are
+    looked up FETCH_BATCH_SIZE at a time, on a single connection.
+    """
+    with get_replica_pool().connection() as connection:
+        cursor = connection.cursor()
+        for name_batch in chunked_iter(file_names, FETCH_BATCH_SIZE):
+            query = '''
+            SELECT %s
+            FROM image
+            WHERE img_name IN (%s);
+            ''' % (', '.join(IMAGE_COLS), ', '.join(['?'] * len(name_batch)))
+            cursor.execute(query, tuple(name_batch))
+            for row in cursor.fetchall():
+                yield dict(zip(IMAGE_COLS, row))
+        cursor.close()
 
 
 if __name__ == '__main__':
-    imgs = get_files('Images_from_Wiki_Loves_Monuments_2015_in_France')
+    imgs = list(get_files('Images_from_Wiki_Loves_Monuments_2015_in_France'))
     import pdb; pdb.set_trace()
@@ -1,20 +1,27 @@
 
+import Queue
 import datetime
-import urllib2
+import threading
+from multiprocessing.pool import ThreadPool
 
-from unicodecsv import DictReader
+from unicodecsv import DictReader, reader as csv_reader
+from boltons.iterutils import chunked_iter, unique
 
-import rdb
-from labs import get_files
+from labs import (get_files_by_name,
+                  IMAGE_COLS,
+                  FETCH_BATCH_SIZE,
+                  POOL_SIZE)
+from fetchers import open_cached_url
+from mirror import get_files
 
-CSV_FULL_COLS = ['img_name',
-                 'img_major_mime',
-                 'img_minor_mime',
-                 'img_width',
-                 'img_height',
-                 'img_user',
-                 'img_user_text',
-                 'img_timestamp']
+CSV_FULL_COLS = IMAGE_COLS
+
+# one worker per pooled replica connection
+CATEGORY_WORKERS = POOL_SIZE
+# how many batches of files fetched workers can get ahead of the import
+CATEGORY_QUEUE_SIZE = 2 * CATEGORY_WORKERS
+_CATEGORY_DONE = object()
+BRIEF_CSV_HEADERS = ('img_name', 'filename', 'file', 'title')
 
 
 def wpts2dt(timestamp):
@@ -22,7 +29,10 @@ def wpts2dt(timestamp):
     return datetime.datetime.strptime(timestamp, wpts_format)
 
 
-def make_entry(edict):
+def make_raw_entry(edict):
+    """Normalizes a labs/CSV image row into a dict of Entry column
+    values, ready for a bulk insert (or for ``Entry(**raw_entry)``).
+    """
     width = int(edict['img_width'])
     height = int(edict['img_height'])
     raw_entry = {'name': edict['img_name'],
@@ -34,46 +44,130 @@ def make_entry(edict):
                  'upload_user_text': edict['img_user_text']}
     raw_entry['upload_date'] = wpts2dt(edict['img_timestamp'])
     raw_entry['resolution'] = width * height
-    return rdb.Entry(**raw_entry)
+    return raw_entry
 
 
 def load_full_csv(csv_file_obj):
-    # TODO: streaming this for big CSVs is an unnecessary headache
-
-    ret = []
+    """Checks the header, then returns a generator of raw entry dicts
+    (see make_raw_entry), read from *csv_file_obj* one row at a time, so
+    that large CSVs can be imported without holding every row in memory.
+    """
     dr = DictReader(csv_file_obj)
 
     for key in CSV_FULL_COLS:
         if key not in dr.fieldnames:
             raise ValueError('missing required column "%s" in csv file' % key)
 
-    for edict in dr:
-        entry = make_entry(edict)
-        ret.append(entry)
+    return (make_raw_entry(edict) for edict in dr)
 
-    return ret
+
+def normalize_file_name(name):
+    """Converts a file page title, with or without its "File:"
+    namespace, to the underscored, capitalized form used in the image
+    table (and Entry.name).
+    """
+    name = name.strip()
+    if name[:5].lower() == 'file:':
+        name = name[5:].strip()
+    name = name.replace(' ', '_')
+    return name[:1].upper() + name[1:]
 
 
 def load_brief_csv(csv_file_obj):
-    "Just the image names, we'll look up the rest in the DB"
-    return
+    """Just the image names, we'll look up the rest in the DB. Generates
+    normalized file names from the first column, skipping blank rows and
+    an optional header row.
+    """
+    rows = csv_reader(csv_file_obj, encoding='utf8')
+    for i, row in enumerate(rows):
+        if not row or not row[0].strip():
+            continue
+        if i == 0 and row[0].strip().lower() in BRIEF_CSV_HEADERS:
+            continue
+        yield normalize_file_name(row[0])
 
 
 def get_entries_from_gist_csv(raw_url):
-    resp = urllib2.urlopen(raw_url)
-    ret = load_full_csv(resp)
-    return ret
-
-
-def load_category(category_name):
-    ret = []
-    files = get_files(category_name)
-
-    for edict in files:
-        entry = make_entry(edict)
-        ret.append(entry)
-
-    return ret
+    return load_full_csv(open_cached_url(raw_url))
+
+
+def get_names_from_gist_csv(raw_url):
+    return load_brief_csv(open_cached_url(raw_url))
+
+
+def load_files_by_name(file_names):
+    files = get_files_by_name(file_names)
+    return (make_raw_entry(edict) for edict in files)
+
+
+def load_category(category_name, after_name=None):
+    files = get_files(category_name, after_name=after_name)
+    return (make_raw_entry(edict) for edict in files)
+
+
+def load_categories(category_names, workers=CATEGORY_WORKERS):
+    """Generates raw entries for the files in any of *category_names*,
+    once per file, however many of the categories it is in.
+
+    Categories are fetched concurrently, on up to *workers* threads,
+    which hand batches of files over a bounded queue. Files are yielded
+    in the order they arrive, deduplicated by name as they go, so the
+    import starts as soon as any category returns its first batch.
+    """
+    category_names = unique(category_names)
+    if not category_names:
+        return
+    batch_queue = Queue.Queue(CATEGORY_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def put(item):
+        # the consumer may stop early, so don't block forever on a
+        # full queue
+        while not stopped.is_set():
+            try:
+                batch_queue.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def fetch_category(category_name):
+        files = None
+        try:
+            files = get_files(category_name)
+            for batch in chunked_iter(files, FETCH_BATCH_SIZE):
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        finally:
+            if files is not None:
+                files.close()
+        put(_CATEGORY_DONE)
+
+    pool = ThreadPool(min(workers, len(category_names)))
+    try:
+        for category_name in category_names:
+            pool.apply_async(fetch_category, (category_name,))
+        pool.close()
+
+        seen_names = set()
+        remaining = len(category_names)
+        while remaining:
+            item = batch_queue.get()
+            if item is _CATEGORY_DONE:
+                remaining -= 1
+                continue
+            elif isinstance(item, Exception):
+                raise item
+            for edict in item:
+                if edict['img_name'] in seen_names:
+                    continue
+                seen_names.add(edict['img_name'])
+                yield make_raw_entry(edict)
+    finally:
+        stopped.set()
 
 
 """
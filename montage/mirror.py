@@ -0,0 +1,267 @@
+"""A local SQLite mirror of Commons category membership and file
+metadata, consulted by the category loaders before the replica.
+
+Each category is refreshed incrementally: only files added to it since
+the newest cl_timestamp already mirrored are fetched from the replica,
+and not more often than every MIRROR_MAX_AGE seconds. Files removed
+from a category (or deleted outright) are only dropped by a full
+refresh, which replaces the incremental one every MIRROR_FULL_MAX_AGE
+seconds, and is also how a category is first mirrored.
+
+Fetched files are written a batch at a time, in short transactions, so
+that the other category workers of a parallel import are not kept
+waiting on the mirror while the replica is read. During a full refresh,
+files are passed on to the loader as each batch is written, so the
+import need not wait for the whole category either.
+
+Where the replica is unreachable, as in development or during an
+outage, categories already in the mirror are served from it as-is, so
+the mirror can also be filled ahead of time (with add_files) for
+offline imports and tests.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+from boltons.fileutils import mkdir_p
+from boltons.iterutils import chunked_iter
+
+from labs import IMAGE_COLS, FETCH_BATCH_SIZE, REPLICA_ERRORS
+from labs import get_files as get_replica_files
+
+
+MIRROR_PATH = os.path.expanduser('~/.montage/category_mirror.db')
+MIRROR_MAX_AGE = 600
+MIRROR_FULL_MAX_AGE = 86400
+MIRROR_TIMEOUT = 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+  %s,
+  PRIMARY KEY (img_name)
+);
+CREATE TABLE IF NOT EXISTS category_files (
+  cl_to TEXT,
+  img_name TEXT,
+  cl_timestamp TEXT,
+  PRIMARY KEY (cl_to, img_name)
+);
+CREATE TABLE IF NOT EXISTS categories (
+  cl_to TEXT PRIMARY KEY,
+  max_cl_timestamp TEXT,
+  refresh_time REAL,
+  full_refresh_time REAL
+);
+''' % ',\n  '.join(['%s TEXT' % col for col in IMAGE_COLS])
+
+
+def _to_text(value):
+    # the replica connection returns raw bytes, which sqlite will only
+    # store as text if they're decoded first
+    if isinstance(value, str):
+        return value.decode('utf8')
+    return value
+
+
+class CategoryMirror(object):
+    def __init__(self, path=MIRROR_PATH, max_age=MIRROR_MAX_AGE,
+                 full_max_age=MIRROR_FULL_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.full_max_age = full_max_age
+        if os.path.dirname(path):
+            mkdir_p(os.path.dirname(path))
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # a connection per call, since imports fetch categories on
+        # several threads
+        return sqlite3.connect(self.path, timeout=MIRROR_TIMEOUT)
+
+    def _get_category_row(self, conn, category_name):
+        return conn.execute('SELECT max_cl_timestamp, refresh_time,'
+                            ' full_refresh_time'
+                            ' FROM categories WHERE cl_to = ?',
+                            (category_name,)).fetchone()
+
+    def has_category(self, category_name):
+        category_name = category_name.replace(' ', '_')
+        with closing(self._connect()) as conn:
+            return self._get_category_row(conn, category_name) is not None
+
+    def is_full_refresh_due(self, category_name):
+        with closing(self._connect()) as conn:
+            row = self._get_category_row(conn, category_name)
+        return self._is_full_refresh_due(row)
+
+    def _is_full_refresh_due(self, row):
+        if not row:
+            return True
+        full_refresh_time = row[2] or 0
+        return time.time() - full_refresh_time >= self.full_max_age
+
+    def refresh(self, category_name, full=False):
+        """Brings a category up to date from the replica, unless it was
+        refreshed less than max_age seconds ago. The refresh is a full
+        one, which also drops files no longer in the category, if
+        *full* is passed, or if the last full refresh was more than
+        full_max_age seconds ago. Returns the number of files fetched.
+        """
+        category_name = category_name.replace(' ', '_')
+        with closing(self._connect()) as conn:
+            row = self._get_category_row(conn, category_name)
+        full = full or self._is_full_refresh_due(row)
+        if not full and time.time() - row[1] < self.max_age:
+            return 0
+
+        since = None if full else row[0]
+        changes = get_replica_files(category_name, since=since)
+        return self.add_files(category_name, changes, replace=full)
+
+    def iter_full_refresh(self, category_name):
+        """Fully refreshes a category from the replica, generating each
+        file's dict, in name order, as soon as the batch it arrived in
+        has been written to the mirror.
+        """
+        files = get_replica_files(category_name)
+        return self.iter_add_files(category_name, files, replace=True)
+
+    def add_files(self, category_name, file_dicts, replace=False):
+        """Adds files to the mirror as members of a category.
+        *file_dicts* have IMAGE_COLS, and optionally cl_timestamp. With
+        *replace*, *file_dicts* are the category's complete membership,
+        and mirrored files not among them are removed from it. Returns
+        the number of files added.
+        """
+        count = 0
+        for _ in self.iter_add_files(category_name, file_dicts, replace):
+            count += 1
+        return count
+
+    def iter_add_files(self, category_name, file_dicts, replace=False):
+        "Like add_files, but generates each file dict once it's written"
+        category_name = category_name.replace(' ', '_')
+        file_sql = ('INSERT OR REPLACE INTO files (%s) VALUES (%s)'
+                    % (', '.join(IMAGE_COLS),
+                       ', '.join(['?'] * len(IMAGE_COLS))))
+        link_sql = ('INSERT OR REPLACE INTO category_files'
+                    ' (cl_to, img_name, cl_timestamp) VALUES (?, ?, ?)')
+        start_time = time.time()
+        seen_names = set()
+        with closing(self._connect()) as conn:
+            row = self._get_category_row(conn, category_name)
+            max_ts, full_refresh_time = None, None
+            if replace:
+                full_refresh_time = start_time
+            elif row:
+                max_ts, full_refresh_time = row[0], row[2]
+            # file_dicts is usually streaming from the replica, so each
+            # batch gets its own transaction, rather than holding the
+            # write lock for the whole category
+            for batch in chunked_iter(file_dicts, FETCH_BATCH_SIZE):
+                file_rows, link_rows = [], []
+                for fd in batch:
+                    file_rows.append([_to_text(fd[col])
+                                      for col in IMAGE_COLS])
+                    ts = _to_text(fd.get('cl_timestamp'))
+                    if ts is not None:
+                        ts = unicode(ts)
+                        max_ts = max(max_ts, ts)
+                    link_rows.append((category_name,
+                                      _to_text(fd['img_name']),
+                                      ts))
+                if replace:
+                    seen_names.update([link_row[1] for link_row in link_rows])
+                with conn:
+                    conn.executemany(file_sql, file_rows)
+                    conn.executemany(link_sql, link_rows)
+                for fd in batch:
+                    yield fd
+
+            with conn:
+                if replace:
+                    self._remove_unseen(conn, category_name, seen_names)
+                conn.execute('INSERT OR REPLACE INTO categories'
+                             ' (cl_to, max_cl_timestamp, refresh_time,'
+                             '  full_refresh_time)'
+                             ' VALUES (?, ?, ?, ?)',
+                             (category_name, max_ts, start_time,
+                              full_refresh_time))
+
+    def _remove_unseen(self, conn, category_name, seen_names):
+        cursor = conn.execute('SELECT img_name FROM category_files'
+                              ' WHERE cl_to = ?', (category_name,))
+        unseen = [(category_name, img_name) for (img_name,) in cursor
+                  if img_name not in seen_names]
+        conn.executemany('DELETE FROM category_files'
+                         ' WHERE cl_to = ? AND img_name = ?', unseen)
+        return len(unseen)
+
+    def get_files(self, category_name, after_name=None):
+        """Generates a dict of IMAGE_COLS for each mirrored file in a
+        category, in name order, starting after *after_name*.
+        """
+        category_name = category_name.replace(' ', '_')
+        query = ('SELECT %s FROM category_files'
+                 ' JOIN files USING (img_name)'
+                 ' WHERE cl_to = ? AND img_name > ?'
+                 ' ORDER BY img_name'
+                 % ', '.join(['files.%s' % col for col in IMAGE_COLS]))
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(query, (category_name, after_name or ''))
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(IMAGE_COLS, row))
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_mirror():
+    "The process-wide category mirror, at MIRROR_PATH"
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = CategoryMirror()
+    return _mirror
+
+
+def get_files(category_name, after_name=None):
+    """The loaders' view of a category, in name order, starting after
+    *after_name*. A category due a full refresh is streamed from the
+    replica as it is mirrored. Otherwise it is refreshed incrementally
+    and read from the mirror, which is also the fallback when the
+    replica can't be reached, if the category has been mirrored before.
+    """
+    mirror = get_mirror()
+    category_name = category_name.replace(' ', '_')
+    last_name = after_name
+    try:
+        if after_name is None and mirror.is_full_refresh_due(category_name):
+            for file_dict in mirror.iter_full_refresh(category_name):
+                last_name = _to_text(file_dict['img_name'])
+                yield file_dict
+            return
+        if not mirror.has_category(category_name):
+            # resuming an import from a category that was never mirrored
+            for file_dict in get_replica_files(category_name,
+                                               after_name=after_name):
+                last_name = _to_text(file_dict['img_name'])
+                yield file_dict
+            return
+        mirror.refresh(category_name)
+    except REPLICA_ERRORS:
+        if not mirror.has_category(category_name):
+            raise
+    # picking up after the last file streamed, if the replica went away
+    # partway through
+    for file_dict in mirror.get_files(category_name, after_name=last_name):
+        yield file_dict
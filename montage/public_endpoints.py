@@ -1,25 +1,30 @@
 
+import json
 import datetime
 
-from clastic import redirect
+from clastic import redirect, Response
 from mwoauth import Handshaker, RequestToken
 
 from mw import public
-from rdb import User
+from rdb import User, CampaignResults
 
-from utils import load_env_config
+from utils import load_env_config, DoesNotExist
 
 config = load_env_config()
 DEBUG = config.get('debug', False)
 
 WIKI_OAUTH_URL = "https://meta.wikimedia.org/w/index.php"
 
+# campaign results don't change once materialized
+RESULTS_MAX_AGE = 30 * 24 * 60 * 60
+
 
 def get_public_routes():
     ret = [('/', home),
            ('/login', login),
            ('/logout', logout),
-           ('/complete_login', complete_login)]
+           ('/complete_login', complete_login),
+           ('/campaign/<campaign_id:int>/results', get_campaign_results)]
     return ret
 
 
@@ -104,4 +109,26 @@ def complete_login(request, consumer_token, cookie, rdb_session):
     return redirect(return_to_url)
 
 
+@public
+def get_campaign_results(request, rdb_session, campaign_id):
+    """Serves the results summary materialized when the campaign was
+    finalized, as-is, with long-lived caching headers.
+    """
+    results = rdb_session.query(CampaignResults)\
+                         .filter_by(campaign_id=campaign_id)\
+                         .order_by(CampaignResults.id.desc())\
+                         .first()
+    if results is None:
+        raise DoesNotExist('no results for campaign #%s' % campaign_id)
+
+    body = json.dumps({'data': results.summary,
+                       'errors': [],
+                       'status': 'success'})
+    resp = Response(body, mimetype='application/json')
+    resp.cache_control.public = True
+    resp.cache_control.max_age = RESULTS_MAX_AGE
+    resp.set_etag('campaign-results-%s' % results.id)
+    return resp.make_conditional(request)
+
+
 PUBLIC_ROUTES = get_public_routes()
@@ -4,7 +4,7 @@
 import random
 import datetime
 import itertools
-from collections import Counter, defaultdict
+from collections import defaultdict
 from math import ceil
 
 from sqlalchemy import (Text,
@@ -15,15 +15,25 @@ from sqlalchemy import (Text,
                         Boolean,
                         DateTime,
                         TIMESTAMP,
-                        ForeignKey)
-from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship, joinedload
+                        ForeignKey,
+                        UniqueConstraint,
+                        Index,
+                        event)
+from sqlalchemy.sql import (func,
+                            select,
+                            exists,
+                            literal,
+                            literal_column,
+                            case,
+                            cast)
+from sqlalchemy.orm import Session, relationship, joinedload
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.associationproxy import association_proxy
 
 from boltons.strutils import slugify
-from boltons.iterutils import chunked, first, unique_iter
+from boltons.iterutils import chunked, chunked_iter, first, unique_iter
 from boltons.statsutils import mean
+from boltons.cacheutils import LRU
 
 from utils import (format_date,
                    to_unicode,
@@ -31,7 +41,13 @@ from utils import (format_date,
                    weighted_choice,
                    PermissionDenied, DoesNotExist, InvalidAction)
 from imgutils import make_mw_img_url
-from loaders import get_entries_from_gist_csv, load_category
+from loaders import (get_entries_from_gist_csv,
+                     get_names_from_gist_csv,
+                     load_category,
+                     load_categories,
+                     load_files_by_name)
+from tally import RatingTally, PairwiseTally
+from analytics import RatingMatrix
 from simple_serdes import DictableBase, JSONEncodedDict
 
 Base = declarative_base(cls=DictableBase)
@@ -45,6 +61,56 @@ DEFAULT_ROUND_CONFIG = {'show_link': True,
 ONE_MEGAPIXEL = 1e6
 DEFAULT_MIN_RESOLUTION = 2 * ONE_MEGAPIXEL
 IMPORT_CHUNK_SIZE = 200
+# a running import that hasn't checkpointed in this long has likely lost
+# its worker, and may be resumed without being cancelled first
+IMPORT_STALE_AGE = datetime.timedelta(minutes=15)
+RESOLVE_CHUNK_SIZE = 1000
+# the Entry columns filled in by loaders.make_raw_entry
+RAW_ENTRY_COLS = ['name',
+                  'mime_major',
+                  'mime_minor',
+                  'width',
+                  'height',
+                  'upload_user_id',
+                  'upload_user_text',
+                  'upload_date',
+                  'resolution']
+# by dialect name, prefixes that make INSERT skip rows which would
+# violate a unique constraint, e.g., entries whose name already exists
+INSERT_IGNORE_PREFIXES = {'sqlite': 'OR IGNORE',
+                          'mysql': 'IGNORE'}
+# by dialect name, functions formatting a DATETIME column like str() does
+# a datetime without microseconds, e.g., in dq_reason messages
+DATETIME_FORMATTERS = {
+    'sqlite': lambda col: func.strftime('%Y-%m-%d %H:%M:%S', col),
+    'mysql': lambda col: func.date_format(col, '%Y-%m-%d %H:%i:%s')}
+
+
+def _format_mysql_float(expr):
+    # adding a DOUBLE turns a DECIMAL like 2.50 into 2.5, which MySQL
+    # prints as '2.5', but prints 4.0 as '4', where Python has '4.0'
+    text = func.concat(expr + literal_column('0e0'))
+    return case([(func.locate('.', text) == 0, func.concat(text, '.0'))],
+                else_=text)
+
+
+# by dialect name, functions formatting a float expression like str()
+# does a Python float, e.g., resolutions in dq_reason messages
+FLOAT_FORMATTERS = {
+    'sqlite': lambda expr: cast(expr, String),
+    'mysql': _format_mysql_float}
+TALLY_BATCH_SIZE = 1000
+# jurors rank every entry in a ranking round, and its pairwise matrix
+# has a row per ordered pair of entries, so both grow fast with size
+MAX_RANKING_ENTRIES = 40
+EXPORT_BATCH_SIZE = 1000
+# MySQL's plain TEXT tops out at 64KB, too small for a large round's
+# advancing ids. TEXT(n) is promoted to MEDIUMTEXT there.
+LARGE_TEXT_LENGTH = 2 ** 24 - 1
+# rounds never change campaigns, nor round entries rounds, so the ids
+# log_action needs can be cached for the life of the process
+ID_CACHE_SIZE = 10000
+AUDIT_LOG_BUFFER_KEY = 'audit_log_buffer'
 
 
 """
@@ -141,7 +207,9 @@ class Campaign(Base):
     create_date = Column(TIMESTAMP, server_default=func.now())
     flags = Column(JSONEncodedDict)
 
-    rounds = relationship('Round', back_populates='campaign')
+    # in creation order, which get_campaign_results_summary relies on
+    rounds = relationship('Round', back_populates='campaign',
+                          order_by='Round.id')
     campaign_coords = relationship('CampaignCoord')
     coords = association_proxy('campaign_coords', 'user',
                                creator=lambda user: CampaignCoord(coord=user))
@@ -336,6 +404,7 @@ class Entry(Base):
 
 class RoundEntry(Base):
     __tablename__ = 'round_entries'
+    __table_args__ = (UniqueConstraint('round_id', 'entry_id'),)
 
     id = Column(Integer, primary_key=True)
     entry_id = Column(Integer, ForeignKey('entries.id'))
@@ -392,6 +461,23 @@ class Ranking(Base):
     flags = Column(JSONEncodedDict)
 
 
+class RankingPair(Base):
+    """One cell of a ranking round's pairwise preference matrix: the
+    number of jurors who have ranked the winner above the loser. Rows
+    are created when the round opens, and counts are incremented in
+    place as each juror's ranking is submitted.
+    """
+    __tablename__ = 'ranking_pairs'
+
+    round_id = Column(Integer, ForeignKey('rounds.id'), primary_key=True)
+    winner_id = Column(Integer, ForeignKey('round_entries.id'),
+                       primary_key=True)
+    loser_id = Column(Integer, ForeignKey('round_entries.id'),
+                      primary_key=True)
+
+    count = Column(Integer, default=0)
+
+
 class Task(Base):
     __tablename__ = 'tasks'
 
@@ -442,18 +528,22 @@ class RoundResultsSummary(Base):
     * Ranking-based
         * ?
 
+    Summaries are tagged with the round's ratings_version (see
+    CoordinatorDAO.get_round_ratings_version), and only served while
+    that version is current.
     """
     __tablename__ = 'results_summaries'
 
     id = Column(Integer, primary_key=True)
 
-    round_id = Column(Integer, ForeignKey('rounds.id'))
+    round_id = Column(Integer, ForeignKey('rounds.id'), index=True)
+    ratings_version = Column(String(255))
 
-    summary = Column(JSONEncodedDict)
+    summary = Column(JSONEncodedDict(LARGE_TEXT_LENGTH))
 
     create_date = Column(TIMESTAMP, server_default=func.now())
 
-'''
+
 class CampaignResults(Base):
     """
     (Same as last round results?)
@@ -467,21 +557,80 @@ class CampaignResults(Base):
     * Organizers and coordinators
     * Dates
 
+    This is materialized once, when the campaign is finalized, so that
+    the public results page can be served without any joins.
     """
     __tablename__ = 'campaign_results'
 
     id = Column(Integer, primary_key=True)
 
-    campaign_id = Column(Integer, ForeignKey('campaign.id'))
+    campaign_id = Column(Integer, ForeignKey('campaigns.id'), index=True)
 
-    summary = Column(JSONEncodedDict)
+    summary = Column(JSONEncodedDict(LARGE_TEXT_LENGTH))
 
     create_date = Column(TIMESTAMP, server_default=func.now())
-'''
+
+
+class ImportJob(Base):
+    """Progress of an entry import, checkpointed after every committed
+    chunk, so that an import that fails or is cancelled partway through
+    can be resumed (see CoordinatorDAO.resume_import).
+
+    *offset* is the number of raw entries consumed so far, and
+    *last_name* the name of the last one. The counts are running totals.
+    """
+    __tablename__ = 'import_jobs'
+
+    id = Column(Integer, primary_key=True)
+
+    round_id = Column(Integer, ForeignKey('rounds.id'), index=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+
+    import_method = Column(String(255))
+    params = Column(JSONEncodedDict)
+    source = Column(Text)
+    status = Column(String(255))  # running, complete, failed, cancelled
+
+    offset = Column(Integer, default=0)
+    last_name = Column(String(255))
+    entry_count = Column(Integer, default=0)
+    new_entry_count = Column(Integer, default=0)
+    new_round_entry_count = Column(Integer, default=0)
+    disqualified_count = Column(Integer, default=0)
+
+    create_date = Column(TIMESTAMP, server_default=func.now())
+    checkpoint_date = Column(DateTime)
+
+    round = relationship('Round')
+
+    def to_info_dict(self):
+        ret = {'id': self.id,
+               'round_id': self.round_id,
+               'user_id': self.user_id,
+               'import_method': self.import_method,
+               'source': self.source,
+               'status': self.status,
+               'offset': self.offset,
+               'last_name': self.last_name,
+               'entry_count': self.entry_count,
+               'new_entry_count': self.new_entry_count,
+               'new_round_entry_count': self.new_round_entry_count,
+               'disqualified_count': self.disqualified_count,
+               'create_date': format_date(self.create_date),
+               'checkpoint_date': format_date(self.checkpoint_date)}
+        return ret
 
 
 class AuditLogEntry(Base):
     __tablename__ = 'audit_log_entries'
+    # each filter of MaintainerDAO.get_audit_log gets an index ending in
+    # id, so a page of it is one index range scan in id order
+    __table_args__ = (
+        Index('ix_audit_log_campaign_id_id', 'campaign_id', 'id'),
+        Index('ix_audit_log_round_id_id', 'round_id', 'id'),
+        Index('ix_audit_log_user_id_id', 'user_id', 'id'),
+        Index('ix_audit_log_action_id', 'action', 'id'),
+        Index('ix_audit_log_create_date', 'create_date'))
 
     id = Column(Integer, primary_key=True)
 
@@ -511,6 +660,58 @@ class AuditLogEntry(Base):
         return ret
 
 
+_round_campaign_ids = LRU(max_size=ID_CACHE_SIZE)
+_round_entry_round_ids = LRU(max_size=ID_CACHE_SIZE)
+
+
+def get_round_campaign_id(rdb_session, round_id):
+    try:
+        return _round_campaign_ids[round_id]
+    except KeyError:
+        pass
+    campaign_id = rdb_session.query(Round.campaign_id)\
+                             .filter(Round.id == round_id)\
+                             .scalar()
+    if campaign_id is not None:
+        _round_campaign_ids[round_id] = campaign_id
+    return campaign_id
+
+
+def get_round_entry_round_id(rdb_session, round_entry_id):
+    try:
+        return _round_entry_round_ids[round_entry_id]
+    except KeyError:
+        pass
+    round_id = rdb_session.query(RoundEntry.round_id)\
+                          .filter(RoundEntry.id == round_entry_id)\
+                          .scalar()
+    if round_id is not None:
+        _round_entry_round_ids[round_entry_id] = round_id
+    return round_id
+
+
+def flush_audit_log(rdb_session):
+    """Writes the audit log entries buffered by log_action, in one
+    multi-row INSERT. Called automatically before every commit; call it
+    directly to read back entries from the current transaction.
+    """
+    rows = rdb_session.info.pop(AUDIT_LOG_BUFFER_KEY, None)
+    if rows:
+        rdb_session.execute(AuditLogEntry.__table__.insert(), rows)
+    return
+
+
+@event.listens_for(Session, 'before_commit')
+def _flush_audit_log_before_commit(rdb_session):
+    flush_audit_log(rdb_session)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _clear_audit_log_after_rollback(rdb_session, previous_transaction):
+    # entries logged in a transaction that rolled back didn't happen
+    rdb_session.info.pop(AUDIT_LOG_BUFFER_KEY, None)
+
+
 class UserDAO(object):
     """The Data Acccess Object wraps the rdb_session and active user
     model, providing a layer for model manipulation through
@@ -536,6 +737,12 @@ class UserDAO(object):
         return self.rdb_session.query(*a, **kw)
 
     def log_action(self, action, **kw):
+        """Buffers an audit log entry, to be inserted along with the rest
+        of the buffer when the session commits (see flush_audit_log).
+        Round and campaign ids are filled in from the round entry or
+        round where necessary, from the objects passed if possible, and
+        otherwise from a process-wide id cache.
+        """
         # TODO: file logging here too
         user_id = self.user.id if self.user else None
         round_entry = kw.pop('round_entry', None)
@@ -546,15 +753,21 @@ class UserDAO(object):
         round_id = kw.pop('round_id', rnd.id if rnd else None)
 
         if not round_id and round_entry_id:
-            rnd = self.query(RoundEntry).get(round_entry_id).round
-            round_id = rnd.id
+            if round_entry is not None and round_entry.round_id:
+                round_id = round_entry.round_id
+            else:
+                round_id = get_round_entry_round_id(self.rdb_session,
+                                                    round_entry_id)
 
         campaign = kw.pop('campaign', None)
         campaign_id = kw.pop('campaign_id', campaign.id if campaign else None)
 
         if round_id and not campaign_id:
-            campaign = self.query(Round).get(round_id).campaign
-            campaign_id = campaign.id
+            if rnd is not None and rnd.id == round_id and rnd.campaign_id:
+                campaign_id = rnd.campaign_id
+            else:
+                campaign_id = get_round_campaign_id(self.rdb_session,
+                                                    round_id)
 
         cn_role = self.__class__.__name__.replace('DAO', '').lower()
         role = kw.pop('role', cn_role)
@@ -562,16 +775,17 @@ class UserDAO(object):
         message = kw.pop('message', None)
         flags = dict(kw.pop('flags', {}))
 
-        ale = AuditLogEntry(user_id=user_id,
-                            campaign_id=campaign_id,
-                            round_id=round_id,
-                            round_entry_id=round_entry_id,
-                            role=role,
-                            action=action,
-                            message=message,
-                            flags=flags)
-
-        self.rdb_session.add(ale)
+        ale_row = {'user_id': user_id,
+                   'campaign_id': campaign_id,
+                   'round_id': round_id,
+                   'round_entry_id': round_entry_id,
+                   'role': role,
+                   'action': action,
+                   'message': message,
+                   'flags': flags}
+
+        buf = self.rdb_session.info.setdefault(AUDIT_LOG_BUFFER_KEY, [])
+        buf.append(ale_row)
         return
 
 
@@ -612,6 +826,11 @@ class CoordinatorDAO(UserDAO):
                     .one_or_none()
         return round
 
+    def get_round_entry_count(self, rnd):
+        return self.query(func.count(RoundEntry.id))\
+                   .filter(RoundEntry.round_id == rnd.id)\
+                   .scalar()
+
     def get_round_task_counts(self, rnd):
         # the fact that these are identical for two DAOs shows it
         # should be on the Round model or somewhere else shared
@@ -634,15 +853,79 @@ class CoordinatorDAO(UserDAO):
                 'total_open_tasks': total_open_tasks,
                 'percent_tasks_open': percent_open}
 
-    def get_entry_name_map(self, filenames):
-        entries = self.query(Entry)\
-                      .filter(Entry.name.in_(filenames))\
-                      .all()
-        ret = {}
-        for entry in entries:
-            name = entry.name
-            ret[name] = entry
-        return ret
+    def get_round_entry_rows(self, rnd):
+        query = self.query(RoundEntry.id,
+                           Entry.name,
+                           Entry.mime_major,
+                           Entry.mime_minor,
+                           Entry.width,
+                           Entry.height,
+                           Entry.resolution,
+                           Entry.upload_user_text,
+                           Entry.upload_date,
+                           RoundEntry.dq_reason)\
+                    .filter(RoundEntry.entry_id == Entry.id,
+                            RoundEntry.round_id == rnd.id)
+        return iter_keyset_batches(query, RoundEntry.id)
+
+    def get_round_vote_rows(self, rnd):
+        vote_type = Ranking if rnd.vote_method == 'ranking' else Rating
+        query = self.query(vote_type.id,
+                           Entry.name,
+                           User.username,
+                           vote_type.value,
+                           vote_type.create_date)\
+                    .filter(vote_type.round_entry_id == RoundEntry.id,
+                            vote_type.user_id == User.id,
+                            RoundEntry.entry_id == Entry.id,
+                            RoundEntry.round_id == rnd.id)
+        return iter_keyset_batches(query, vote_type.id)
+
+    def get_round_result_rows(self, rnd):
+        """Returns batches of result rows for a round, from its results
+        summary: (round_entry_id, name, score) rows for a ranking round,
+        in rank order, and otherwise (round_entry_id, name, uploader,
+        average, vote_count) rows. Disqualified entries are left out.
+        """
+        if rnd.vote_method == 'ranking':
+            ranking = self._get_stored_ranking(rnd)
+            if ranking is None:
+                method = rnd.config.get('ranking_method', 'schulze')
+                ranking = self.get_round_ranking(rnd, method=method)
+            name_map = dict(self.query(RoundEntry.id, Entry.name)
+                            .filter(RoundEntry.entry_id == Entry.id,
+                                    RoundEntry.round_id == rnd.id)
+                            .all())
+            return [[(re_id, name_map[re_id], score)
+                     for re_id, score in ranking]]
+
+        # read eagerly, so that a newly computed summary is saved with
+        # the request, rather than while the download streams
+        entry_results = self.get_round_entry_results(rnd)
+        return self._iter_entry_result_rows(entry_results)
+
+    def _iter_entry_result_rows(self, entry_results):
+        for result_batch in chunked_iter(entry_results, EXPORT_BATCH_SIZE):
+            re_ids = [re_id for re_id, _, _ in result_batch]
+            entry_map = dict([(re_id, (name, uploader)) for
+                              re_id, name, uploader in
+                              self.query(RoundEntry.id,
+                                         Entry.name,
+                                         Entry.upload_user_text)
+                              .filter(RoundEntry.entry_id == Entry.id,
+                                      RoundEntry.id.in_(re_ids))])
+            yield [(re_id,) + entry_map[re_id] + (average, vote_count)
+                   for re_id, average, vote_count in result_batch]
+
+    def _get_stored_ranking(self, rnd):
+        "The ranking stored when a ranking round was finalized, if any"
+        summary_row = self.query(RoundResultsSummary)\
+                          .filter_by(round_id=rnd.id)\
+                          .order_by(RoundResultsSummary.id.desc())\
+                          .first()
+        if summary_row is None:
+            return None
+        return summary_row.summary.get('ranking')
 
     # write methods
     def edit_campaign(self, campaign_id, campaign_dict):
@@ -683,104 +966,306 @@ class CoordinatorDAO(UserDAO):
 
         return rnd
 
-    def autodisqualify_by_date(self, rnd):
+    def autodisqualify_by_date(self, rnd, dry_run=False):
         campaign = rnd.campaign
         min_date = campaign.open_date
         max_date = campaign.close_date
 
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == rnd.id)\
-                            .filter((Entry.upload_date < min_date) |
-                                    (Entry.upload_date > max_date))\
-                            .all()
-
-        for round_entry in round_entries:
-            dq_reason = ('upload date %s is out of campaign date range %s - %s'
-                         % (round_entry.entry.upload_date, min_date, max_date))
-            round_entry.dq_reason = dq_reason
-            round_entry.dq_user_id = self.user.id
+        entry_filter = (Entry.upload_date < min_date) | \
+                       (Entry.upload_date > max_date)
+        dialect_name = self.rdb_session.bind.dialect.name
+        format_date_col = DATETIME_FORMATTERS.get(
+            dialect_name, lambda col: cast(col, String))
+        dq_reason = (literal('upload date ')
+                     + format_date_col(Entry.upload_date)
+                     + literal(' is out of campaign date range %s - %s'
+                               % (min_date, max_date)))
+        dq_count = self._disqualify_matching(rnd, entry_filter, dq_reason,
+                                             dry_run=dry_run)
+        if dry_run:
+            return dq_count
 
         msg = ('%s disqualified %s entries outside of date range %s - %s'
-               % (self.user.username, len(round_entries), min_date, max_date))
+               % (self.user.username, dq_count, min_date, max_date))
         self.log_action('autodisqualify_by_date', round=rnd, message=msg)
 
-        return round_entries
+        return dq_count
 
-    def autodisqualify_by_resolution(self, rnd):
+    def autodisqualify_by_resolution(self, rnd, dry_run=False):
         # TODO: get from config
         min_res = rnd.config.get('min_resolution', DEFAULT_MIN_RESOLUTION)
-
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == rnd.id)\
-                            .filter(Entry.resolution < min_res)\
-                            .all()
-
         min_res_str = round(min_res / ONE_MEGAPIXEL, 2)
-        for r_ent in round_entries:
-            entry_res_str = round(r_ent.entry.resolution / ONE_MEGAPIXEL, 2)
-            dq_reason = ('resolution %s is less than %s minimum '
-                         % (entry_res_str, min_res_str))
-            r_ent.dq_reason = dq_reason
-            r_ent.dq_user_id = self.user.id
+
+        entry_filter = Entry.resolution < min_res
+        dialect_name = self.rdb_session.bind.dialect.name
+        format_float = FLOAT_FORMATTERS.get(dialect_name,
+                                            lambda expr: cast(expr, String))
+        dq_reason = (literal('resolution ')
+                     + format_float(func.round(Entry.resolution
+                                               / ONE_MEGAPIXEL, 2))
+                     + literal(' is less than %s minimum ' % min_res_str))
+        dq_count = self._disqualify_matching(rnd, entry_filter, dq_reason,
+                                             dry_run=dry_run)
+        if dry_run:
+            return dq_count
 
         msg = ('%s disqualified %s entries smaller than %s megapixels'
-               % (self.user.username, len(round_entries), min_res_str))
+               % (self.user.username, dq_count, min_res_str))
         self.log_action('autodisqualify_by_resolution', round=rnd, message=msg)
 
-        return round_entries
+        return dq_count
 
     def autodisqualify_by_uploader(self,
                                    rnd,
                                    dq_coords=True,
                                    dq_organizers=True,
-                                   dq_maintainers=False):
+                                   dq_maintainers=False,
+                                   dry_run=False):
+        dq_group = self.get_uploader_dq_group(rnd,
+                                              dq_coords=dq_coords,
+                                              dq_organizers=dq_organizers,
+                                              dq_maintainers=dq_maintainers)
+        if not dq_group:
+            return 0
+
+        entry_filter = Entry.upload_user_text.in_(dq_group.keys())
+        dq_reason = (literal('upload user ')
+                     + Entry.upload_user_text
+                     + literal(' is ')
+                     + case(dq_group, value=Entry.upload_user_text))
+        dq_count = self._disqualify_matching(rnd, entry_filter, dq_reason,
+                                             dry_run=dry_run)
+        if dry_run:
+            return dq_count
+
+        msg = ('%s disqualified %s entries based on upload user'
+               % (self.user.username, dq_count))
+        self.log_action('autodisqualify_by_uploader', round=rnd, message=msg)
+
+        return dq_count
+
+    def _disqualify_matching(self, rnd, entry_filter, dq_reason,
+                             dry_run=False):
+        """Disqualifies all of a round's entries matching *entry_filter*,
+        with a single UPDATE, setting *dq_reason*, a SQL expression over
+        the Entry columns. If the round has opened, the entries'
+        incomplete tasks are cancelled, as in disqualify_round_entries.
+        Returns the number of round entries matched, only counting them
+        if *dry_run* is set.
+        """
+        matching_ids = select([Entry.id]).where(entry_filter)
+        if dry_run:
+            return self.query(func.count(RoundEntry.id))\
+                       .filter(RoundEntry.round_id == rnd.id,
+                               RoundEntry.entry_id.in_(matching_ids))\
+                       .scalar()
+
+        self._check_can_disqualify(rnd)
+        self.rdb_session.flush()
+        dq_reason = select([dq_reason])\
+            .where(Entry.id == RoundEntry.entry_id)\
+            .as_scalar()
+        update = RoundEntry.__table__.update()\
+                                     .where(RoundEntry.round_id == rnd.id)\
+                                     .where(RoundEntry.entry_id
+                                            .in_(matching_ids))\
+                                     .values(dq_reason=dq_reason,
+                                             dq_user_id=self.user.id)
+        dq_count = self.rdb_session.execute(update).rowcount
+        if rnd.open_date:
+            matching_re_ids = select([RoundEntry.id])\
+                .where(RoundEntry.round_id == rnd.id)\
+                .where(RoundEntry.entry_id.in_(matching_ids))
+            self._cancel_open_tasks(matching_re_ids)
+        return dq_count
+
+    def _check_can_disqualify(self, rnd):
+        if rnd.status in ('cancelled', 'finalized'):
+            raise InvalidAction('cannot disqualify entries in a %s round'
+                                % rnd.status)
+        if rnd.open_date and rnd.vote_method == 'ranking':
+            raise InvalidAction('cannot disqualify entries from a ranking'
+                                ' round once it has opened')
+
+    def _cancel_open_tasks(self, round_entry_ids):
+        """Cancels the incomplete tasks of *round_entry_ids*, a list or
+        select of ids, with a single UPDATE. Returns the number of tasks
+        cancelled.
+        """
+        update = Task.__table__.update()\
+            .where(Task.round_entry_id.in_(round_entry_ids))\
+            .where(Task.complete_date == None)\
+            .where(Task.cancel_date == None)\
+            .values(cancel_date=datetime.datetime.utcnow())
+        return self.rdb_session.execute(update).rowcount
+
+    def disqualify_round_entries(self, rnd, round_entry_ids, reason=None):
+        """Disqualifies the listed round entries, with one UPDATE per
+        IMPORT_CHUNK_SIZE ids. If the round has opened, their incomplete
+        tasks are cancelled the same way. Returns the number of round
+        entries disqualified.
+        """
+        self._check_can_disqualify(rnd)
+        if not reason:
+            reason = 'disqualified by %s' % self.user.username
+
+        self.rdb_session.flush()
+        dq_count, cancelled_count = 0, 0
+        for id_chunk in chunked(sorted(set(round_entry_ids)),
+                                IMPORT_CHUNK_SIZE):
+            update = RoundEntry.__table__.update()\
+                .where(RoundEntry.round_id == rnd.id)\
+                .where(RoundEntry.id.in_(id_chunk))\
+                .values(dq_user_id=self.user.id, dq_reason=reason)
+            dq_count += self.rdb_session.execute(update).rowcount
+            if not rnd.open_date:
+                continue
+            in_round = select([RoundEntry.id])\
+                .where(RoundEntry.round_id == rnd.id)\
+                .where(RoundEntry.id.in_(id_chunk))
+            cancelled_count += self._cancel_open_tasks(in_round)
+
+        msg = ('%s disqualified %s entries (%s)'
+               % (self.user.username, dq_count, reason))
+        if cancelled_count:
+            msg += ', cancelling %s open tasks' % cancelled_count
+        self.log_action('disqualify_entries', round=rnd, message=msg)
+
+        return dq_count
+
+    def requalify_round_entries(self, rnd, round_entry_ids):
+        """Reverses the disqualification of the listed round entries, with
+        one UPDATE per IMPORT_CHUNK_SIZE ids. Tasks are created when a
+        round opens, so this is only possible before then. Returns the
+        number of round entries requalified.
+        """
+        if rnd.open_date:
+            raise InvalidAction('entries can only be requalified before the'
+                                ' round is opened')
+
+        self.rdb_session.flush()
+        requalified_count = 0
+        for id_chunk in chunked(sorted(set(round_entry_ids)),
+                                IMPORT_CHUNK_SIZE):
+            update = RoundEntry.__table__.update()\
+                .where(RoundEntry.round_id == rnd.id)\
+                .where(RoundEntry.id.in_(id_chunk))\
+                .where(RoundEntry.dq_user_id != None)\
+                .values(dq_user_id=None, dq_reason=None)
+            requalified_count += self.rdb_session.execute(update).rowcount
+
+        msg = ('%s requalified %s entries'
+               % (self.user.username, requalified_count))
+        self.log_action('requalify_entries', round=rnd, message=msg)
+
+        return requalified_count
+
+    def get_uploader_dq_group(self,
+                              rnd,
+                              dq_coords=True,
+                              dq_organizers=True,
+                              dq_maintainers=False):
+        "Maps the usernames whose uploads are disqualified to their role"
         dq_group = {}
-        dq_usernames = [j.username for j in rnd.jurors]
-        for username in dq_usernames:
-            dq_group[username] = 'juror'
+        for juror in rnd.jurors:
+            dq_group[juror.username] = 'juror'
 
         if dq_coords:
-            coord_usernames = [c.username for c in rnd.campaign.coords]
-            dq_usernames += coord_usernames
-            for username in coord_usernames:
-                dq_group[username] = 'coordinator'
+            for coord in rnd.campaign.coords:
+                dq_group[coord.username] = 'coordinator'
 
         if dq_organizers:
             organizers = self.query(User)\
                              .filter_by(is_organizer=True)\
                              .all()
-            organizer_usernames = [u.username for u in organizers]
-            dq_usernames += organizer_usernames
-            for username in organizer_usernames:
-                dq_group[username] = 'organizer'
+            for organizer in organizers:
+                dq_group[organizer.username] = 'organizer'
 
         if dq_maintainers:
-            dq_usernames += MAINTAINERS
             for username in MAINTAINERS:
                 dq_group[username] = 'maintainer'
 
-        dq_usernames = set(dq_usernames)
-
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == rnd.id)\
-                            .filter(Entry.upload_user_text.in_(dq_usernames))\
-                            .all()
-
-        for round_entry in round_entries:
-            upload_user = round_entry.entry.upload_user_text
-            dq_reason = 'upload user %s is %s'\
-                        % (upload_user, dq_group[upload_user])
-            round_entry.dq_reason = dq_reason
-            round_entry.dq_user_id = self.user.id
-
-        msg = ('%s disqualified %s entries based on upload user'
-               % (self.user.username, len(round_entries)))
-        self.log_action('autodisqualify_by_uploader', round=rnd, message=msg)
+        return dq_group
 
-        return round_entries
+    def get_dq_rules(self, rnd):
+        """Returns (rule name, check) pairs for the round's automatic
+        disqualification rules, as applied by the autodisqualify_by_*
+        methods. Each check takes a raw entry dict (see
+        loaders.make_raw_entry) and returns a dq_reason, or None if the
+        entry passes.
+        """
+        campaign = rnd.campaign
+        min_date = campaign.open_date
+        max_date = campaign.close_date
+        min_res = rnd.config.get('min_resolution', DEFAULT_MIN_RESOLUTION)
+        min_res_str = round(min_res / ONE_MEGAPIXEL, 2)
+        dq_group = self.get_uploader_dq_group(rnd)
+
+        def check_date(raw_entry):
+            upload_date = raw_entry['upload_date']
+            if (min_date and upload_date < min_date) or \
+               (max_date and upload_date > max_date):
+                return ('upload date %s is out of campaign date range %s - %s'
+                        % (upload_date, min_date, max_date))
+
+        def check_resolution(raw_entry):
+            resolution = raw_entry['resolution']
+            if resolution < min_res:
+                entry_res_str = round(resolution / ONE_MEGAPIXEL, 2)
+                return ('resolution %s is less than %s minimum '
+                        % (entry_res_str, min_res_str))
+
+        def check_uploader(raw_entry):
+            upload_user = raw_entry['upload_user_text']
+            if upload_user in dq_group:
+                return 'upload user %s is %s' % (upload_user,
+                                                 dq_group[upload_user])
+
+        return [('date', check_date),
+                ('resolution', check_resolution),
+                ('uploader', check_uploader)]
+
+    def preview_import(self, rnd, raw_entries):
+        """Counts what importing *raw_entries* into *rnd* would do, in a
+        single streaming pass with a couple of name lookups per chunk,
+        without creating or writing anything. As in the import itself,
+        only entries not already in the round count as disqualified.
+        """
+        dq_rules = self.get_dq_rules(rnd)
+        dq_counts = dict([(rule_name, 0) for rule_name, _ in dq_rules])
+        total_count, known_count, in_round_count, dq_count = 0, 0, 0, 0
+
+        raw_entries = unique_iter(raw_entries,
+                                  key=lambda e: to_unicode(e['name']))
+        for entry_chunk in chunked_iter(raw_entries, IMPORT_CHUNK_SIZE):
+            names = [to_unicode(e['name']) for e in entry_chunk]
+            known_count += self.query(Entry)\
+                               .filter(Entry.name.in_(names))\
+                               .count()
+            in_round_names = set([name for (name,) in
+                                  self.query(Entry.name)
+                                  .join(RoundEntry)
+                                  .filter(RoundEntry.round_id == rnd.id,
+                                          Entry.name.in_(names))])
+            in_round_count += len(in_round_names)
+            for raw_entry in entry_chunk:
+                if to_unicode(raw_entry['name']) in in_round_names:
+                    continue
+                disqualified = False
+                for rule_name, check in dq_rules:
+                    if check(raw_entry):
+                        dq_counts[rule_name] += 1
+                        disqualified = True
+                dq_count += disqualified
+            total_count += len(entry_chunk)
+
+        return {'total_count': total_count,
+                'known_count': known_count,
+                'new_count': total_count - known_count,
+                'in_round_count': in_round_count,
+                'new_round_entry_count': total_count - in_round_count,
+                'disqualified_count': dq_count,
+                'dq_counts': dq_counts}
 
     def pause_round(self, rnd):
         rnd.status = 'paused'
@@ -793,7 +1278,18 @@ class CoordinatorDAO(UserDAO):
             raise InvalidAction('can only activate round in a paused state,'
                                 ' not %r' % (rnd.status,))
         if not rnd.open_date:
+            if rnd.vote_method == 'ranking':
+                entry_count = self.query(func.count(RoundEntry.id))\
+                                  .filter(RoundEntry.round_id == rnd.id,
+                                          RoundEntry.dq_user_id == None)\
+                                  .scalar()
+                if entry_count > MAX_RANKING_ENTRIES:
+                    raise InvalidAction('ranking rounds can have at most %s'
+                                        ' entries, not %s'
+                                        % (MAX_RANKING_ENTRIES, entry_count))
             tasks = create_initial_tasks(self.rdb_session, rnd)
+            if rnd.vote_method == 'ranking':
+                create_ranking_pairs(self.rdb_session, rnd)
             rnd.open_date = datetime.datetime.utcnow()
 
             msg = '%s opened round %s' % (self.user.username, rnd.name)
@@ -806,72 +1302,385 @@ class CoordinatorDAO(UserDAO):
 
         return
 
-    def add_entries_from_cat(self, rnd, cat_name):
-        entries = load_category(cat_name)
+    def add_entries_from_cat(self, rnd, cat_name, autodisqualify=False):
+        return self.start_import(rnd, 'category', {'category': cat_name},
+                                 autodisqualify=autodisqualify)
 
-        entries, new_entry_count = self.add_entries(rnd, entries)
+    def add_entries_from_cats(self, rnd, cat_names, autodisqualify=False):
+        return self.start_import(rnd, 'categories', {'categories': cat_names},
+                                 autodisqualify=autodisqualify)
 
-        msg = ('%s loaded %s entries from category (%s), %s new entries added'
-               % (self.user.username, len(entries), cat_name, new_entry_count))
-        self.log_action('add_entries', message=msg, round=rnd)
+    def add_entries_from_csv_gist(self, rnd, gist_url, autodisqualify=False):
+        return self.start_import(rnd, 'gistcsv', {'gist_url': gist_url},
+                                 autodisqualify=autodisqualify)
 
-        return entries
+    def add_entries_from_brief_csv_gist(self, rnd, gist_url,
+                                        autodisqualify=False):
+        return self.start_import(rnd, 'gistcsv_brief', {'gist_url': gist_url},
+                                 autodisqualify=autodisqualify)
 
-    def add_entries_from_csv_gist(self, rnd, gist_url):
-        # NOTE: this no longer creates RoundEntries, use
-        # add_round_entries to do this.
+    def start_import(self, rnd, import_method, params, autodisqualify=False):
+        """Creates an ImportJob and runs it. The job is committed along
+        with every chunk imported, so if the import fails partway, it
+        can pick up where it left off with resume_import.
+        """
+        if rnd.status != 'paused':
+            raise InvalidAction('round must be paused to add new entries')
+        if import_method == 'categories':
+            source = 'categories(%s)' % ', '.join(params['categories'])
+        elif import_method in ('category', 'gistcsv', 'gistcsv_brief'):
+            source = '%s(%s)' % (import_method, params.values()[0])
+        else:
+            raise InvalidAction('unknown import method: %r' % import_method)
+
+        job = ImportJob(round=rnd,
+                        user_id=self.user.id,
+                        import_method=import_method,
+                        params=dict(params, autodisqualify=autodisqualify),
+                        source=source,
+                        status='running',
+                        checkpoint_date=datetime.datetime.utcnow())
+        self.rdb_session.add(job)
+        self.rdb_session.commit()
 
-        entries = get_entries_from_gist_csv(gist_url)
+        return self._run_import(job)
+
+    def resume_import(self, job):
+        """Continues a failed or cancelled import from its last
+        checkpoint, or a running one that hasn't checkpointed in
+        IMPORT_STALE_AGE, as when its worker was killed. CSV gists are read from the cache and skip the
+        entries already consumed, and a category is re-queried for names
+        after the last one imported. Other sources have no stable order,
+        so they are replayed from the start, which is cheap since
+        already-imported entries are deduplicated (and filename-only
+        imports then resolve locally). Their entry count is restarted,
+        and the new entry counts carry over.
+        """
+        is_stale = (job.status == 'running'
+                    and job.checkpoint_date is not None
+                    and (datetime.datetime.utcnow() - job.checkpoint_date
+                         > IMPORT_STALE_AGE))
+        if job.status not in ('failed', 'cancelled') and not is_stale:
+            raise InvalidAction('only failed, cancelled or stalled imports'
+                                ' can be resumed, not %s imports'
+                                % job.status)
+        if job.round.status != 'paused':
+            raise InvalidAction('round must be paused to add new entries')
+        if job.import_method not in ('gistcsv', 'category'):
+            job.offset = 0
+            job.last_name = None
+            job.entry_count = 0
+        job.status = 'running'
+        self.rdb_session.commit()
 
-        entries, new_entry_count = self.add_entries(rnd, entries)
+        msg = ('%s resumed import #%s of %s at entry %s'
+               % (self.user.username, job.id, job.source, job.offset))
+        self.log_action('resume_import', message=msg, round=job.round)
+
+        return self._run_import(job)
+
+    def cancel_import(self, job):
+        "Stops a running import after the chunk it's working on"
+        if job.status != 'running':
+            raise InvalidAction('only running imports can be cancelled')
+        job.status = 'cancelled'
+
+        msg = ('%s cancelled import #%s of %s'
+               % (self.user.username, job.id, job.source))
+        self.log_action('cancel_import', message=msg, round=job.round)
+
+    def get_import_job(self, job_id):
+        job = self.query(ImportJob)\
+                  .filter_by(id=job_id)\
+                  .first()
+        if job is None:
+            raise DoesNotExist('import job #%s does not exist' % job_id)
+        if self.get_round(job.round_id) is None:
+            raise PermissionDenied()
+        return job
 
-        msg = ('%s loaded %s entries from csv gist (%r), %s new entries added'
-               % (self.user.username, len(entries), gist_url, new_entry_count))
-        self.log_action('add_entries', message=msg, round=rnd)
+    def _run_import(self, job):
+        params = job.params
+        missing_names = None
+        try:
+            # sources start reading (e.g., the CSV header) as soon as
+            # they're opened, so this can fail too
+            if job.import_method == 'gistcsv':
+                raw_entries = get_entries_from_gist_csv(params['gist_url'])
+                raw_entries = itertools.islice(raw_entries, job.offset, None)
+            elif job.import_method == 'category':
+                raw_entries = load_category(params['category'],
+                                            after_name=job.last_name)
+            elif job.import_method == 'categories':
+                raw_entries = load_categories(params['categories'])
+            elif job.import_method == 'gistcsv_brief':
+                names = get_names_from_gist_csv(params['gist_url'])
+                missing_names = []
+                raw_entries = self.resolve_entry_names(names, missing_names)
+
+            ret = self.import_entries(job.round, raw_entries,
+                                      source=job.source,
+                                      autodisqualify=params['autodisqualify'],
+                                      job=job)
+        except Exception:
+            self.rdb_session.rollback()
+            job.status = 'failed'
+            self.rdb_session.commit()
+            raise
+
+        if job.status == 'running':
+            job.status = 'complete'
+        ret['import_job_id'] = job.id
+        ret['status'] = job.status
+        if missing_names is not None:
+            ret['missing_count'] = len(missing_names)
+            ret['missing_names'] = missing_names
+        return ret
 
-        return entries
+    def resolve_entry_names(self, names, missing_names=None):
+        """Generates raw entry dicts for file *names*, RESOLVE_CHUNK_SIZE
+        names at a time. Names already in the entries table are read from
+        there, and only the rest are fetched from the Commons replica.
+        Names found in neither are appended to *missing_names*, if it is
+        passed.
+        """
+        entry_cols = [getattr(Entry, col) for col in RAW_ENTRY_COLS]
+        names = unique_iter(to_unicode(name) for name in names)
+        for name_chunk in chunked_iter(names, RESOLVE_CHUNK_SIZE):
+            unknown_names = set(name_chunk)
+            rows = self.query(*entry_cols)\
+                       .filter(Entry.name.in_(name_chunk))\
+                       .all()
+            for row in rows:
+                unknown_names.discard(row.name)
+                yield dict(zip(RAW_ENTRY_COLS, row))
+
+            if not unknown_names:
+                continue
+            for raw_entry in load_files_by_name(sorted(unknown_names)):
+                unknown_names.discard(to_unicode(raw_entry['name']))
+                yield raw_entry
+            if missing_names is not None:
+                missing_names.extend(sorted(unknown_names))
+
+    def import_entries(self, rnd, raw_entries, source='',
+                       autodisqualify=False, job=None):
+        """Adds *raw_entries*, any iterable of Entry column dicts such as
+        the generators in loaders.py, to the database and to *rnd*.
+        Entries are consumed and upserted IMPORT_CHUNK_SIZE at a time
+        (see add_entries), so memory use does not grow with the size of
+        the import.
+
+        With *autodisqualify*, the round's disqualification rules (see
+        get_dq_rules) are checked against each entry as it streams
+        through, and new round entries are inserted already
+        disqualified, instead of running the autodisqualify_by_* methods
+        afterward.
+
+        With an ImportJob, *job*, counts start from the job's, and the
+        job is checkpointed and committed with every chunk. The import
+        stops early if the job is cancelled.
+
+        Returns a dict of entry_count, new_entry_count,
+        new_round_entry_count and disqualified_count.
+        """
+        if rnd.status != 'paused':
+            raise InvalidAction('round must be paused to add new entries')
 
-    def add_entries(self, rnd, entries):
-        entry_chunks = chunked(entries, IMPORT_CHUNK_SIZE)
-        ret = []
-        new_entry_count = 0
+        dq_rules = self.get_dq_rules(rnd) if autodisqualify else []
+        entry_count, new_entry_count, new_round_entry_count = 0, 0, 0
+        dq_count = 0
+        if job is not None:
+            entry_count = job.entry_count
+            new_entry_count = job.new_entry_count
+            new_round_entry_count = job.new_round_entry_count
+            dq_count = job.disqualified_count
+
+        for entry_chunk in chunked_iter(raw_entries, IMPORT_CHUNK_SIZE):
+            entry_id_map, new_count = self.add_entries(entry_chunk)
+
+            raw_entry_map = dict([(e['name'], e) for e in entry_chunk])
+            ok_rows, dq_rows = [], []
+            for name, entry_id in sorted(entry_id_map.items(),
+                                         key=lambda item: item[1]):
+                row = {'round_id': rnd.id,
+                       'entry_id': entry_id,
+                       'dq_user_id': None,
+                       'dq_reason': None}
+                raw_entry = raw_entry_map.get(name)
+                for _, check in dq_rules:
+                    dq_reason = raw_entry and check(raw_entry)
+                    if dq_reason:
+                        row['dq_user_id'] = self.user.id
+                        row['dq_reason'] = dq_reason
+                        break
+                if row['dq_user_id']:
+                    dq_rows.append(row)
+                else:
+                    ok_rows.append(row)
+            # disqualified rows go in separately, so that the rowcounts
+            # tell how many of each were actually new to the round
+            new_ok_count = self._insert_round_entries(rnd, ok_rows)
+            new_dq_count = self._insert_round_entries(rnd, dq_rows)
+
+            entry_count += len(entry_id_map)
+            new_entry_count += new_count
+            new_round_entry_count += new_ok_count + new_dq_count
+            dq_count += new_dq_count
+
+            if job is not None:
+                job.offset += len(entry_chunk)
+                job.last_name = entry_chunk[-1]['name']
+                job.entry_count = entry_count
+                job.new_entry_count = new_entry_count
+                job.new_round_entry_count = new_round_entry_count
+                job.disqualified_count = dq_count
+                job.checkpoint_date = datetime.datetime.utcnow()
+                self.rdb_session.commit()
+                # committing expires the job, so this picks up a
+                # cancellation from another request
+                if job.status != 'running':
+                    break
+
+        msg = ('%s loaded %s entries, %s new entries added'
+               % (self.user.username, entry_count, new_entry_count))
+        if source:
+            msg += ' (from %s)' % (source,)
+        self.log_action('add_entries', message=msg, round=rnd)
 
-        for entry_chunk in entry_chunks:
-            entry_names = [to_unicode(e.name) for e in entry_chunk]
-            db_entries = self.get_entry_name_map(entry_names)
+        msg = ('%s added %s round entries, %s new'
+               % (self.user.username, entry_count, new_round_entry_count))
+        if autodisqualify:
+            msg += ', %s disqualified' % dq_count
+        if source:
+            msg += ' (from %s)' % (source,)
+        self.log_action('add_round_entries', message=msg, round=rnd)
 
-            for entry in entry_chunk:
-                db_entry = db_entries.get(to_unicode(entry.name))
-                if db_entry:
-                    entry = db_entry
-                else:
-                    new_entry_count += 1
-                    self.rdb_session.add(entry)
+        return {'entry_count': entry_count,
+                'new_entry_count': new_entry_count,
+                'new_round_entry_count': new_round_entry_count,
+                'disqualified_count': dq_count}
 
-                ret.append(entry)
+    def add_entries(self, raw_entries):
+        """Bulk upserts a chunk of raw entry dicts on the unique
+        entries.name, with one multi-row INSERT that skips names already
+        in the database, followed by one SELECT for the ids.
 
-        return ret, new_entry_count
+        Returns a map of entry name to id, and the number of entries
+        that were new.
+        """
+        raw_entry_map = {}
+        for raw_entry in raw_entries:
+            raw_entry['name'] = to_unicode(raw_entry['name'])
+            raw_entry_map.setdefault(raw_entry['name'], raw_entry)
+        if not raw_entry_map:
+            return {}, 0
+        names = raw_entry_map.keys()
+
+        dialect_name = self.rdb_session.bind.dialect.name
+        insert = Entry.__table__.insert()
+        if dialect_name in INSERT_IGNORE_PREFIXES:
+            insert = insert.prefix_with(INSERT_IGNORE_PREFIXES[dialect_name])
+            new_raw_entries = raw_entry_map.values()
+        else:
+            existing_names = self.query(Entry.name)\
+                                 .filter(Entry.name.in_(names))\
+                                 .all()
+            new_raw_entries = dict(raw_entry_map)
+            for (name,) in existing_names:
+                new_raw_entries.pop(name, None)
+            new_raw_entries = new_raw_entries.values()
 
-    def add_round_entries(self, rnd, entries, source=''):
+        new_entry_count = 0
+        if new_raw_entries:
+            res = self.rdb_session.execute(insert, new_raw_entries)
+            new_entry_count = res.rowcount
+
+        entry_id_map = dict(self.query(Entry.name, Entry.id)
+                            .filter(Entry.name.in_(names))
+                            .all())
+        return entry_id_map, new_entry_count
+
+    def _insert_round_entries(self, rnd, round_entry_rows):
+        """Inserts round entry row dicts into *rnd* with one multi-row
+        INSERT that skips entries already in the round, per the unique
+        (round_id, entry_id) constraint. Returns the number of round
+        entries added.
+        """
+        if not round_entry_rows:
+            return 0
+        dialect_name = self.rdb_session.bind.dialect.name
+        insert = RoundEntry.__table__.insert()
+        if dialect_name in INSERT_IGNORE_PREFIXES:
+            insert = insert.prefix_with(INSERT_IGNORE_PREFIXES[dialect_name])
+        else:
+            entry_ids = [row['entry_id'] for row in round_entry_rows]
+            existing_ids = set([e_id for (e_id,) in
+                                self.query(RoundEntry.entry_id)
+                                .filter(RoundEntry.round_id == rnd.id,
+                                        RoundEntry.entry_id.in_(entry_ids))])
+            round_entry_rows = [row for row in round_entry_rows
+                                if row['entry_id'] not in existing_ids]
+            if not round_entry_rows:
+                return 0
+        return self.rdb_session.execute(insert, round_entry_rows).rowcount
+
+    def add_round_entries_from_round(self, rnd, prev_rnd, threshold=None):
+        """Carries the entries advancing from a rating round over into
+        *rnd* with a single INSERT ... SELECT over the previous round's
+        averaged ratings. Entries already in *rnd* are skipped.
+        """
         if rnd.status != 'paused':
             raise InvalidAction('round must be paused to add new entries')
-        existing_names = set(self.rdb_session.query(Entry.name).
-                             join(RoundEntry).
-                             filter_by(round=rnd).
-                             all())
-        new_entries = [e for e
-                       in unique_iter(entries, key=lambda e: e.name)
-                       if e.name not in existing_names]
+        if prev_rnd.vote_method not in ('rating', 'yesno'):
+            raise InvalidAction('can only add entries from a rating or'
+                                ' yes/no round, not a %s round'
+                                % prev_rnd.vote_method)
+        if prev_rnd.status != 'finalized':
+            raise InvalidAction('can only add entries from a finalized'
+                                ' round, not a %s round' % prev_rnd.status)
+        if prev_rnd.campaign_id != rnd.campaign_id:
+            raise InvalidAction('can only add entries from a round in the'
+                                ' same campaign')
 
-        rnd.entries.extend(new_entries)
-
-        msg = ('%s added %s round entries, %s new'
-               % (self.user.username, len(entries), len(new_entries)))
-        if source:
-            msg += ' (from %s)' % (source,)
+        if threshold is None:
+            threshold = prev_rnd.config.get('final_threshold')
+        else:
+            try:
+                threshold = float(threshold)
+            except (TypeError, ValueError):
+                raise InvalidAction('expected a numeric threshold, not %r'
+                                    % (threshold,))
+            if not 0.0 <= threshold <= 1.0:
+                raise InvalidAction('expected a threshold between 0 and 1,'
+                                    ' not %r' % threshold)
+        if threshold is None:
+            raise InvalidAction('expected threshold or finalized round')
+
+        prev_re = RoundEntry.__table__.alias('prev_round_entries')
+        already_added = exists().where(RoundEntry.round_id == rnd.id)\
+                                .where(RoundEntry.entry_id
+                                       == prev_re.c.entry_id)
+        avg = func.avg(Rating.value)
+        advancing = select([prev_re.c.entry_id, literal(rnd.id)])\
+            .where(Rating.round_entry_id == prev_re.c.id)\
+            .where(prev_re.c.round_id == prev_rnd.id)\
+            .where(prev_re.c.dq_user_id == None)\
+            .where(~already_added)\
+            .group_by(prev_re.c.id, prev_re.c.entry_id)\
+            .having(avg >= threshold)
+        insert = RoundEntry.__table__.insert()\
+                                     .from_select(['entry_id', 'round_id'],
+                                                  advancing)
+        new_count = self.rdb_session.execute(insert).rowcount
+
+        msg = ('%s added %s round entries from round "%s" (#%s)'
+               ' at threshold %s'
+               % (self.user.username, new_count, prev_rnd.name, prev_rnd.id,
+                  threshold))
         self.log_action('add_round_entries', message=msg, round=rnd)
 
-        return new_entries
+        return new_count
 
     def get_or_create_user(self, user, role, **kw):
         # kw is for including round/round_id/campaign/campaign_id
@@ -923,7 +1732,8 @@ class CoordinatorDAO(UserDAO):
         rnd.status = 'finalized'
         rnd.config['final_threshold'] = threshold
 
-        advance_count = len(self.get_rating_advancing_group(rnd, threshold))
+        summary = self.get_round_results_summary(rnd)
+        advance_count = len(summary['advancing_ids'])
 
         msg = ('%s finalized rating round "%s" at threshold %s,'
                ' with %s entries advancing'
@@ -935,38 +1745,183 @@ class CoordinatorDAO(UserDAO):
     def get_rating_advancing_group(self, rnd, threshold=None):
         assert rnd.vote_method in ('rating', 'yesno')
 
+        final_threshold = rnd.config.get('final_threshold')
         if threshold is None:
-            threshold = rnd.config.get('final_threshold')
+            threshold = final_threshold
         if threshold is None:
             raise ValueError('expected threshold or finalized round')
 
         assert 0.0 <= threshold <= 1.0
 
-        avg = func.avg(Rating.value).label('average')
-
-        results = self.query(RoundEntry, Rating, avg)\
-                      .options(joinedload('entry'))\
-                      .filter_by(round_id=rnd.id)\
-                      .join(Rating)\
-                      .group_by(Rating.round_entry_id)\
-                      .having(avg >= threshold)\
-                      .all()
+        if threshold == final_threshold:
+            summary = self.get_round_results_summary(rnd)
+            advancing_ids = summary['advancing_ids']
+        else:
+            tally = self.get_round_rating_tally(rnd)
+            advancing_ids = tally.get_advancing_ids(threshold)
 
-        entries = [res[0].entry for res in results]
+        entries = []
+        for id_chunk in chunked(advancing_ids, IMPORT_CHUNK_SIZE):
+            entries.extend(self.query(Entry)
+                           .join(RoundEntry)
+                           .filter(RoundEntry.id.in_(id_chunk))
+                           .all())
 
         return entries
 
+    def get_round_ratings_version(self, rnd):
+        """Ratings are only ever added, so the count and latest id of a
+        round's ratings change whenever a new rating arrives. Results
+        also leave out disqualified entries, so the count and id sum of
+        those are part of the version too.
+        """
+        count, max_id = self.query(func.count(Rating.id), func.max(Rating.id))\
+                            .join(RoundEntry)\
+                            .filter(RoundEntry.round_id == rnd.id)\
+                            .one()
+        dq_count, dq_id_sum = self.query(func.count(RoundEntry.id),
+                                         func.sum(RoundEntry.id))\
+                                  .filter(RoundEntry.round_id == rnd.id,
+                                          RoundEntry.dq_user_id != None)\
+                                  .one()
+        return '%s:%s:%s:%s' % (count, max_id or 0, dq_count, dq_id_sum or 0)
+
+    def get_round_results_summary(self, rnd):
+        """Get the tallies and thresholds for a rating round, and the
+        advancing round entry ids for a finalized round, from the
+        RoundResultsSummary cache. The summary is recomputed (and stale
+        summaries discarded) when ratings have arrived or entries have
+        been disqualified since it was stored, or when the round's final
+        threshold has changed.
+        """
+        return self._get_results_summary_row(rnd).summary
+
+    def get_round_juror_stats(self, rnd):
+        """Juror agreement and reliability statistics (see
+        analytics.RatingMatrix), computed on first request and cached in
+        the round's current results summary.
+        """
+        summary_row = self._get_results_summary_row(rnd)
+        juror_stats = summary_row.summary.get('juror_stats')
+        if juror_stats is None:
+            rating_triples = self.query(Rating.user_id,
+                                        Rating.round_entry_id,
+                                        Rating.value)\
+                                 .join(RoundEntry)\
+                                 .filter(RoundEntry.round_id == rnd.id,
+                                         RoundEntry.dq_user_id == None)\
+                                 .yield_per(TALLY_BATCH_SIZE)
+            juror_stats = RatingMatrix(rating_triples).to_dict()
+            summary_row.summary = dict(summary_row.summary,
+                                       juror_stats=juror_stats)
+        return juror_stats
+
+    def get_round_entry_results(self, rnd):
+        """(round_entry_id, average, vote_count) rows for each rated,
+        non-disqualified entry, in id order, computed from the tally on
+        first request and cached in the round's current results
+        summary.
+        """
+        summary_row = self._get_results_summary_row(rnd)
+        entry_results = summary_row.summary.get('entry_results')
+        if entry_results is None:
+            tally = self.get_round_rating_tally(rnd)
+            entry_results = sorted(zip(tally.round_entry_ids,
+                                       tally.averages,
+                                       tally.vote_counts))
+            summary_row.summary = dict(summary_row.summary,
+                                       entry_results=entry_results)
+        return entry_results
+
+    def _get_results_summary_row(self, rnd):
+        ratings_version = self.get_round_ratings_version(rnd)
+        final_threshold = rnd.config.get('final_threshold')
+
+        cached = self.query(RoundResultsSummary)\
+                     .filter_by(round_id=rnd.id,
+                                ratings_version=ratings_version)\
+                     .order_by(RoundResultsSummary.id.desc())\
+                     .first()
+        if cached and cached.summary.get('final_threshold') == final_threshold:
+            return cached
+
+        tally = self.get_round_rating_tally(rnd)
+        uploader_map = dict(self.query(RoundEntry.id, Entry.upload_user_text)
+                            .filter(RoundEntry.entry_id == Entry.id,
+                                    RoundEntry.round_id == rnd.id)
+                            .all())
+        summary = tally.to_dict(uploader_map=uploader_map)
+        summary['final_threshold'] = final_threshold
+        if final_threshold is not None:
+            summary['advancing_ids'] = tally.get_advancing_ids(final_threshold)
+
+        self.query(RoundResultsSummary)\
+            .filter_by(round_id=rnd.id)\
+            .delete()
+        summary_row = RoundResultsSummary(round_id=rnd.id,
+                                          ratings_version=ratings_version,
+                                          summary=summary)
+        self.rdb_session.add(summary_row)
+        return summary_row
+
+    def get_round_rating_tally(self, rnd):
+        rating_pairs = self.query(Rating.round_entry_id, Rating.value)\
+                           .join(RoundEntry)\
+                           .filter(RoundEntry.round_id == rnd.id,
+                                   RoundEntry.dq_user_id == None)\
+                           .yield_per(TALLY_BATCH_SIZE)
+
+        return RatingTally(rating_pairs)
+
     def get_round_average_rating_map(self, rnd):
-        results = self.query(Rating, func.avg(Rating.value).label('average'))\
-                      .join(RoundEntry)\
-                      .filter(Rating.round_entry.has(round_id=rnd.id))\
-                      .group_by(Rating.round_entry_id)\
-                      .all()
+        tally = self.get_round_rating_tally(rnd)
 
-        # thresh_counts = get_threshold_map(r[1] for r in ratings)
-        rating_ctr = Counter([r[1] for r in results])
+        return tally.get_average_map()
 
-        return dict(rating_ctr)
+    def get_round_ranking_tally(self, rnd):
+        assert rnd.vote_method == 'ranking'
+
+        round_entry_ids = [re_id for (re_id,) in
+                           self.query(RoundEntry.id)
+                           .filter(RoundEntry.round_id == rnd.id,
+                                   RoundEntry.dq_user_id == None)]
+        pairs = self.query(RankingPair.winner_id,
+                           RankingPair.loser_id,
+                           RankingPair.count)\
+                    .filter(RankingPair.round_id == rnd.id)\
+                    .all()
+        pair_counts = dict([((w, l), c) for w, l, c in pairs])
+
+        return PairwiseTally(round_entry_ids, pair_counts)
+
+    def get_round_ranking(self, rnd, method='schulze'):
+        tally = self.get_round_ranking_tally(rnd)
+        if method == 'schulze':
+            return tally.get_schulze_ranking()
+        elif method == 'borda':
+            return tally.get_borda_ranking()
+        raise InvalidAction('expected ranking method "schulze" or "borda",'
+                            ' not %r' % method)
+
+    def finalize_ranking_round(self, rnd, method='schulze'):
+        assert rnd.vote_method == 'ranking'
+        # TODO: assert all tasks complete
+
+        rnd.close_date = datetime.datetime.utcnow()
+        rnd.status = 'finalized'
+        rnd.config['ranking_method'] = method
+
+        ranking = self.get_round_ranking(rnd, method=method)
+        summary = {'ranking_method': method,
+                   'ranking': ranking}
+        self.rdb_session.add(RoundResultsSummary(round_id=rnd.id,
+                                                 summary=summary))
+
+        msg = ('%s finalized ranking round "%s" with %s entries ranked by %s'
+               % (self.user.username, rnd.name, len(ranking), method))
+        self.log_action('finalize_round', round=rnd, message=msg)
+
+        return ranking
 
     def modify_jurors(self, rnd, new_jurors):
         # NOTE: this does not add or remove tasks. Contrast this with
@@ -1025,9 +1980,10 @@ class CoordinatorDAO(UserDAO):
         prev_finalized_rnd = final_rnds[-1]  # TODO: these are ordered by date?
         assert prev_finalized_rnd.vote_method != 'ranking'
 
-        advancing_group = self.get_rating_advancing_group(prev_finalized_rnd)
+        summary = self.get_round_results_summary(prev_finalized_rnd)
+        advance_count = len(summary['advancing_ids'])
 
-        assert 1 < len(advancing_group) <= 40  # TODO: configurable max
+        assert 1 < advance_count <= MAX_RANKING_ENTRIES
 
         rnd = self.create_round(campaign,
                                 name=name,
@@ -1035,8 +1991,92 @@ class CoordinatorDAO(UserDAO):
                                 quorum=len(jurors),
                                 vote_method='ranking',
                                 deadline_date=deadline_date)
-        source = 'round(#%s)' % prev_finalized_rnd.id
-        self.add_round_entries(rnd, advancing_group, source=source)
+        self.add_round_entries_from_round(rnd, prev_finalized_rnd)
+
+        return rnd
+
+    def finalize_campaign(self, campaign):
+        # results are served with long-lived caching headers, so they
+        # may only be materialized once
+        already_finalized = self.query(exists().where(
+            CampaignResults.campaign_id == campaign.id)).scalar()
+        if already_finalized:
+            raise InvalidAction('campaign #%s has already been finalized'
+                                % campaign.id)
+        if campaign.active_round:
+            raise InvalidAction('cannot finalize campaign with an active'
+                                ' round, finalize or cancel round #%s first'
+                                % campaign.active_round.id)
+        final_rnds = [r for r in campaign.rounds if r.status == 'finalized']
+        if not final_rnds or final_rnds[-1].vote_method != 'ranking':
+            raise InvalidAction('campaigns can only be finalized after a'
+                                ' finalized ranking round')
+
+        summary = self.get_campaign_results_summary(campaign, final_rnds)
+        results = CampaignResults(campaign_id=campaign.id, summary=summary)
+        self.rdb_session.add(results)
+
+        msg = ('%s finalized campaign "%s" with %s winning entries'
+               % (self.user.username, campaign.name, len(summary['winners'])))
+        self.log_action('finalize_campaign', campaign=campaign, message=msg)
+
+        return results
+
+    def get_campaign_results_summary(self, campaign, final_rnds):
+        round_ids = [r.id for r in campaign.rounds]
+        entry_counts = self._get_round_count_map(RoundEntry, round_ids)
+        rating_counts = self._get_round_count_map(Rating, round_ids)
+        ranking_counts = self._get_round_count_map(Ranking, round_ids)
+
+        rnd_summaries = []
+        for rnd in campaign.rounds:
+            rnd_summary = rnd.to_info_dict()
+            rnd_summary['jurors'] = [j.username for j in rnd.jurors]
+            rnd_summary['total_entries'] = entry_counts.get(rnd.id, 0)
+            rnd_summary['total_votes'] = (rating_counts.get(rnd.id, 0)
+                                          + ranking_counts.get(rnd.id, 0))
+            if rnd.status == 'finalized':
+                if rnd.vote_method == 'ranking':
+                    rnd_summary['ranking_method'] = rnd.config.get(
+                        'ranking_method')
+                else:
+                    rnd_summary['final_threshold'] = rnd.config.get(
+                        'final_threshold')
+            rnd_summaries.append(rnd_summary)
+
+        final_rnd = final_rnds[-1]
+        ranking = self.get_round_ranking(
+            final_rnd, method=final_rnd.config.get('ranking_method',
+                                                   'schulze'))
+        entry_map = dict(self.query(RoundEntry.id, Entry)
+                         .filter(RoundEntry.entry_id == Entry.id,
+                                 RoundEntry.round_id == final_rnd.id)
+                         .all())
+        winners = []
+        for re_id, score in ranking:
+            winner = entry_map[re_id].to_details_dict(with_uploader=True)
+            winner['score'] = score
+            winners.append(winner)
+
+        ret = campaign.to_info_dict()
+        ret.update({'open_date': format_date(campaign.open_date),
+                    'close_date': format_date(campaign.close_date),
+                    'finalize_date': format_date(datetime.datetime.utcnow()),
+                    'coordinators': [u.to_info_dict() for u in campaign.coords],
+                    'rounds': rnd_summaries,
+                    'total_entries': entry_counts.get(round_ids[0], 0),
+                    'total_votes': (sum(rating_counts.values())
+                                    + sum(ranking_counts.values())),
+                    'winners': winners})
+        return ret
+
+    def _get_round_count_map(self, model, round_ids):
+        "Counts RoundEntries, Ratings or Rankings for each round, in one query"
+        query = self.query(RoundEntry.round_id, func.count(model.id))\
+                    .filter(RoundEntry.round_id.in_(round_ids))
+        if model is not RoundEntry:
+            query = query.filter(model.round_entry_id == RoundEntry.id)
+        return dict(query.group_by(RoundEntry.round_id).all())
 
 
 class OrganizerDAO(CoordinatorDAO):
@@ -1081,12 +2121,38 @@ class OrganizerDAO(CoordinatorDAO):
 
 
 class MaintainerDAO(OrganizerDAO):
-    def get_audit_log(self, limit=100, offset=0):
-        audit_logs = self.query(AuditLogEntry)\
-                         .order_by(AuditLogEntry.create_date.desc())\
-                         .limit(limit)\
-                         .offset(offset)\
-                         .all()
+    def get_audit_log(self, limit=100, offset=0, before_id=None,
+                      campaign_id=None, round_id=None, user_id=None,
+                      action=None, start_date=None, end_date=None):
+        """Returns audit log entries, newest first, optionally filtered
+        by campaign, round, user, action and creation date (from
+        *start_date*, up to but not including *end_date*).
+
+        Page with *before_id*, the id of the last entry of the previous
+        page, rather than *offset*: the former is an index seek, however
+        deep the page, whereas the latter reads and skips every entry
+        before the page.
+        """
+        flush_audit_log(self.rdb_session)
+        query = self.query(AuditLogEntry)
+        if campaign_id is not None:
+            query = query.filter(AuditLogEntry.campaign_id == campaign_id)
+        if round_id is not None:
+            query = query.filter(AuditLogEntry.round_id == round_id)
+        if user_id is not None:
+            query = query.filter(AuditLogEntry.user_id == user_id)
+        if action is not None:
+            query = query.filter(AuditLogEntry.action == action)
+        if start_date is not None:
+            query = query.filter(AuditLogEntry.create_date >= start_date)
+        if end_date is not None:
+            query = query.filter(AuditLogEntry.create_date < end_date)
+        if before_id is not None:
+            query = query.filter(AuditLogEntry.id < before_id)
+        audit_logs = query.order_by(AuditLogEntry.id.desc())\
+                          .limit(limit)\
+                          .offset(offset)\
+                          .all()
         return audit_logs
 
     def add_organizer(self, username):
@@ -1221,8 +2287,53 @@ class JurorDAO(UserDAO):
 
         with task1 being the highest rank. this format is designed to
         support ties.
+
+        Besides saving a Ranking per task, this adds the juror's
+        preferences to the round's RankingPair matrix, with one UPDATE
+        per ranked entry. Tied entries are not counted against each other.
         """
-        pass
+        all_tasks = [task for tasks in ranked_tasks for task in tasks]
+        for task in all_tasks:
+            if not task.user == self.user:
+                raise PermissionDenied()
+            if task.complete_date or task.cancel_date:
+                # the RankingPair matrix can't be corrected after the
+                # fact, so a ranking may only be submitted once
+                raise InvalidAction('task %s is already complete or'
+                                    ' cancelled' % task.id)
+        round_ids = set([t.round_entry.round_id for t in all_tasks])
+        if len(round_ids) > 1:
+            raise InvalidAction('can only submit rankings for one round'
+                                ' at a time')
+
+        now = datetime.datetime.utcnow()
+        rank = 0
+        for tasks in ranked_tasks:
+            for task in tasks:
+                ranking = Ranking(user_id=self.user.id,
+                                  task_id=task.id,
+                                  round_entry_id=task.round_entry_id,
+                                  value=rank)
+                self.rdb_session.add(ranking)
+                task.complete_date = now
+            rank += len(tasks)
+
+        if not ranked_tasks:
+            return
+        round_id = ranked_tasks[0][0].round_entry.round_id
+        ranked_below = []
+        for tasks in reversed(ranked_tasks):
+            winner_ids = [t.round_entry_id for t in tasks]
+            if ranked_below:
+                for winner_id in winner_ids:
+                    self.query(RankingPair)\
+                        .filter(RankingPair.round_id == round_id,
+                                RankingPair.winner_id == winner_id,
+                                RankingPair.loser_id.in_(ranked_below))\
+                        .update({'count': RankingPair.count + 1},
+                                synchronize_session=False)
+            ranked_below.extend(winner_ids)
+        return
 
 
 def lookup_user(rdb_session, username):
@@ -1281,6 +2392,28 @@ def create_initial_tasks(rdb_session, rnd):
     return ret
 
 
+def create_ranking_pairs(rdb_session, rnd):
+    """Creates the (initially zeroed) pairwise preference matrix for a
+    ranking round, one RankingPair per ordered pair of round entries,
+    inserted IMPORT_CHUNK_SIZE rows at a time.
+    """
+    round_entry_ids = [re_id for (re_id,) in
+                       rdb_session.query(RoundEntry.id)
+                       .filter(RoundEntry.round_id == rnd.id,
+                               RoundEntry.dq_user_id == None)]
+    pair_rows = ({'round_id': rnd.id,
+                  'winner_id': winner_id,
+                  'loser_id': loser_id,
+                  'count': 0}
+                 for winner_id, loser_id
+                 in itertools.permutations(round_entry_ids, 2))
+    pair_count = 0
+    for row_chunk in chunked_iter(pair_rows, IMPORT_CHUNK_SIZE):
+        rdb_session.execute(RankingPair.__table__.insert(), row_chunk)
+        pair_count += len(row_chunk)
+    return pair_count
+
+
 def reassign_tasks(session, rnd, new_jurors):
     """Different strategies for different outcomes:
 
@@ -1380,6 +2513,27 @@ def reassign_tasks(session, rnd, new_jurors):
             'task_count_mean': mean(task_count_map.values())}
 
 
+def iter_keyset_batches(query, id_column, batch_size=EXPORT_BATCH_SIZE):
+    """Iterates over a column query in lists of up to *batch_size* rows,
+    ordered by *id_column*, which must be the query's first column.
+
+    Each batch is its own "WHERE id > last_id ... LIMIT" query, which
+    keeps memory flat even for very large results. (Query.yield_per is
+    no help here, as the MySQL driver buffers the whole result anyway.)
+    """
+    last_id = None
+    while True:
+        batch_query = query
+        if last_id is not None:
+            batch_query = batch_query.filter(id_column > last_id)
+        batch = batch_query.order_by(id_column).limit(batch_size).all()
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1][0]
+
+
 def make_rdb_session(echo=True):
     from utils import load_env_config
     from sqlalchemy import create_engine
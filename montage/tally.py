@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Tallying for rating and yes/no rounds.
+
+Ratings are streamed once, as (round_entry_id, value) pairs, into
+compact typed arrays. Everything the round closing screen needs (per-entry
+averages and vote counts, the rating histogram, and the threshold
+curve) is derived from those arrays, so previewing and finalizing a
+round do not each need their own GROUP BY over the ratings table.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from utils import get_threshold_map, get_uploader_threshold_map
+
+
+class RatingTally(object):
+    """A single-pass tally of a round's ratings.
+
+    *rating_pairs* is any iterable of (round_entry_id, value) pairs, in
+    any order, such as a column query over the Rating table.
+    """
+    def __init__(self, rating_pairs):
+        self.round_entry_ids = array('l')
+        self.vote_counts = array('l')
+        self.averages = array('d')
+        self.histogram = Counter()
+
+        index_map = {}
+        sums = array('d')
+        for round_entry_id, value in rating_pairs:
+            idx = index_map.get(round_entry_id)
+            if idx is None:
+                idx = index_map[round_entry_id] = len(sums)
+                self.round_entry_ids.append(round_entry_id)
+                self.vote_counts.append(0)
+                sums.append(0.0)
+            sums[idx] += value
+            self.vote_counts[idx] += 1
+            self.histogram[value] += 1
+
+        for total, count in zip(sums, self.vote_counts):
+            self.averages.append(total / count)
+
+    @property
+    def entry_count(self):
+        return len(self.round_entry_ids)
+
+    @property
+    def vote_count(self):
+        return sum(self.vote_counts)
+
+    def get_average_map(self):
+        "Maps each distinct average rating to the number of entries with it"
+        return dict(Counter(self.averages))
+
+    def get_threshold_map(self):
+        return get_threshold_map(self.get_average_map())
+
+    def get_advancing_ids(self, threshold):
+        return [re_id for re_id, avg
+                in zip(self.round_entry_ids, self.averages)
+                if avg >= threshold]
+
+    def get_uploader_threshold_map(self, uploader_map):
+        pairs = [(avg, uploader_map.get(re_id)) for re_id, avg
+                 in zip(self.round_entry_ids, self.averages)]
+        return get_uploader_threshold_map(pairs)
+
+    def get_threshold_curve(self, uploader_map):
+        """Returns ascending (threshold, entry_count, uploader_count)
+        rows, one per distinct average rating, giving the number of
+        entries and distinct uploaders at or above that average.
+        *uploader_map* maps round entry ids to uploader names.
+        """
+        ranked = sorted(zip(self.averages, self.round_entry_ids),
+                        reverse=True)
+        curve = []
+        uploaders = set()
+        for count, (avg, re_id) in enumerate(ranked, 1):
+            uploaders.add(uploader_map.get(re_id))
+            if curve and curve[-1][0] == avg:
+                curve.pop()
+            curve.append((avg, count, len(uploaders)))
+        curve.reverse()
+        return curve
+
+    def to_dict(self, uploader_map=None):
+        """A JSON-friendly summary of the tally. JSON objects only have
+        string keys, so the float-keyed maps are stored as sorted
+        (key, value) pairs. Uploader counts are included if an
+        *uploader_map* is passed.
+        """
+        ret = {'entry_count': self.entry_count,
+               'vote_count': self.vote_count,
+               'histogram': sorted(self.histogram.items()),
+               'ratings': sorted(self.get_average_map().items()),
+               'thresholds': sorted(self.get_threshold_map().items())}
+        if uploader_map is not None:
+            uploader_thresh_map = self.get_uploader_threshold_map(uploader_map)
+            ret['uploader_thresholds'] = sorted(uploader_thresh_map.items())
+            ret['threshold_curve'] = self.get_threshold_curve(uploader_map)
+        return ret
+
+
+class ThresholdExplorer(object):
+    """Answers "how many entries, and how many distinct uploaders, are
+    at or above this threshold?" for any threshold, with a binary search
+    over a precomputed threshold curve (see
+    RatingTally.get_threshold_curve).
+    """
+    def __init__(self, threshold_curve):
+        self.thresholds = array('d', [row[0] for row in threshold_curve])
+        self.entry_counts = array('l', [row[1] for row in threshold_curve])
+        self.uploader_counts = array('l', [row[2] for row in threshold_curve])
+
+    def get_counts(self, threshold):
+        "Returns an (entry_count, uploader_count) pair"
+        idx = bisect_left(self.thresholds, threshold)
+        if idx == len(self.thresholds):
+            return (0, 0)
+        return (self.entry_counts[idx], self.uploader_counts[idx])
+
+
+class PairwiseTally(object):
+    """The pairwise preference matrix for a ranking round.
+
+    *pair_counts* maps (winner_id, loser_id) round entry id pairs to
+    the number of jurors who ranked the winner above the loser. Both
+    Borda and Schulze results can be read straight off the matrix, so
+    there is no need to revisit individual rankings at close.
+    """
+    def __init__(self, round_entry_ids, pair_counts):
+        self.round_entry_ids = sorted(round_entry_ids)
+        self.pair_counts = dict(pair_counts)
+
+    def get_count(self, winner_id, loser_id):
+        return self.pair_counts.get((winner_id, loser_id), 0)
+
+    def get_borda_ranking(self):
+        """With complete rankings, an entry's Borda score is the number of
+        entries it was ranked above, summed across all jurors.
+        """
+        ids = self.round_entry_ids
+        scores = [(sum(self.get_count(a, b) for b in ids), a) for a in ids]
+        scores.sort(key=lambda s: (-s[0], s[1]))
+        return [(a, score) for score, a in scores]
+
+    def get_schulze_ranking(self):
+        """Ranks entries by the Schulze method, returning (round_entry_id,
+        score) pairs, where the score is the number of other entries an
+        entry beats by strongest path. Entries with equal scores are tied.
+        """
+        ids = self.round_entry_ids
+        strength = {}
+        for a in ids:
+            for b in ids:
+                if a == b:
+                    continue
+                d_ab, d_ba = self.get_count(a, b), self.get_count(b, a)
+                strength[a, b] = d_ab if d_ab > d_ba else 0
+
+        for i in ids:
+            for j in ids:
+                if i == j:
+                    continue
+                for k in ids:
+                    if k == i or k == j:
+                        continue
+                    via_i = min(strength[j, i], strength[i, k])
+                    if via_i > strength[j, k]:
+                        strength[j, k] = via_i
+
+        scores = []
+        for a in ids:
+            wins = sum(1 for b in ids
+                       if a != b and strength[a, b] > strength[b, a])
+            scores.append((wins, a))
+        scores.sort(key=lambda s: (-s[0], s[1]))
+        return [(a, score) for score, a in scores]
@@ -82,14 +82,50 @@ def get_mw_userid(username):
 
 
 def get_threshold_map(ratings_map):
+    """Maps each rating threshold to the number of entries at or above
+    it. *ratings_map* maps average ratings to entry counts, and is not
+    modified. The ratings are sorted once, and the counts are running
+    sums from the highest rating down.
+
+    Thresholds are averages rounded to 3 places, but finalizing a round
+    compares the unrounded averages against the threshold, so the count
+    for a threshold leaves out averages that rounded up to it.
+    """
+    ratings = sorted(ratings_map)
+    totals_gte = [0] * (len(ratings) + 1)
+    for i in range(len(ratings) - 1, -1, -1):
+        totals_gte[i] = totals_gte[i + 1] + ratings_map[ratings[i]]
+
+    thresh_counts = {}
+    for rating in ratings:
+        thresh = round(rating, 3)
+        thresh_counts[thresh] = totals_gte[bisect.bisect_left(ratings, thresh)]
+    thresh_counts.setdefault(1.0, 0)
+    thresh_counts.setdefault(0.0, totals_gte[0])
+    return thresh_counts
+
+
+def get_uploader_threshold_map(rating_uploader_pairs):
+    """Maps each rating threshold to the number of distinct uploaders
+    with at least one entry at or above it. Expects an iterable of
+    (average rating, uploader) pairs, one per entry. Thresholds are
+    rounded as in get_threshold_map.
+    """
+    pairs = sorted(rating_uploader_pairs)
+    ratings = [rating for rating, _ in pairs]
+    uploader_counts_gte = [0] * (len(pairs) + 1)
+    uploaders = set()
+    for i in range(len(pairs) - 1, -1, -1):
+        uploaders.add(pairs[i][1])
+        uploader_counts_gte[i] = len(uploaders)
+
     thresh_counts = {}
-    ratings_map[0.0] = ratings_map.get(0.0, 0)
-    ratings_map[1.0] = ratings_map.get(1.0, 0)
-    ratings = ratings_map.keys()
     for rating in ratings:
-        rating = round(rating, 3)
-        total_gte = sum([v for k, v in ratings_map.items() if k >= rating])
-        thresh_counts[rating] = total_gte
+        thresh = round(rating, 3)
+        idx = bisect.bisect_left(ratings, thresh)
+        thresh_counts[thresh] = uploader_counts_gte[idx]
+    thresh_counts.setdefault(1.0, 0)
+    thresh_counts.setdefault(0.0, len(uploaders))
     return thresh_counts
 
 
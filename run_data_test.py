@@ -2,7 +2,8 @@
 import os.path
 import argparse
 
-from montage.rdb import User, Campaign, Round, Base, create_initial_tasks
+from montage.rdb import (User, Campaign, Round, Entry, Base,
+                         create_initial_tasks)
 from montage.loaders import load_full_csv
 
 CUR_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -49,7 +50,7 @@ def populate_initial_data(db_url, debug=False, echo=True):
     CSV_PATH = DATA_PATH + '/wlm2015_ir_5.csv'
 
     with open(CSV_PATH) as f:
-        entries = load_full_csv(f)
+        entries = [Entry(**raw_entry) for raw_entry in load_full_csv(f)]
 
     for entry in entries:
         round.entries.append(entry)